@@ -0,0 +1,94 @@
+# benchmark of OneToMultipleImage.to_representation, run from root of the repo like:
+#   python benchmarks/bench_representation.py --images 1000 --sizes 4
+# baseline ('legacy') is a reconstruction, not the previous code: that raised AttributeError (BaseSerializer has no
+# .get_fields()), so nothing runnable exists to compare with. legacy finds fields by dir() on every call, checks them per
+# icon and returns ReturnDict per item like the previous code, but skips method and serializer fields (broken there).
+# like for like comparison is legacy vs current (both construct a serializer per image), many=True is reported separately
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import django
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure(INSTALLED_APPS=['rest_framework'], MEDIA_URL='/media/')
+    django.setup()
+
+from rest_framework import serializers
+from rest_framework.utils.serializer_helpers import ReturnDict
+
+from onetomultipleimage.fields import OneToMultipleImage
+
+
+class File:
+    def __init__(self, url):
+        self.url = url
+
+
+class Captioned(OneToMultipleImage):
+    caption = serializers.CharField()
+
+
+def legacy(serializer, obj):
+    # reconstruction of previous to_representation + .data, see top of the file
+    fields = {name: getattr(type(serializer), name) for name in dir(type(serializer))
+              if isinstance(getattr(type(serializer), name, None), serializers.Field)}
+    additional_fields = {name: field for name, field in fields.items() if name not in ['image', 'alt', 'size']}
+    rets = []
+    for icon in obj:
+        ret = {'image': icon['image'].url, 'alt': icon.get('alt', ''), 'size': icon.get('size', '')}
+        for field_name, field in additional_fields.items():
+            if icon.get(field_name):
+                if isinstance(field, serializers.SerializerMethodField):
+                    pass
+                elif isinstance(field, serializers.BaseSerializer):
+                    pass
+                else:
+                    ret[field_name] = field.to_representation(icon[field_name])
+        rets.append(ret)
+    return [ReturnDict(ret, serializer=serializer) for ret in rets]
+
+
+def images(count, sizes):
+    return [[{'image': File(f'/media/posts/2024/5/13/{i:012x}-{size}.JPEG'), 'alt': f'{i:06x}-{size}', 'size': size,
+              'caption': 'caption'} for size in sizes] for i in range(count)]
+
+
+def timed(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None or elapsed < best else best
+    return best
+
+
+def run(count=1000, sizes=4, repeat=5):
+    data = images(count, [str(120 * 2 ** i) for i in range(sizes - 1)] + ['default'])
+    rets = {}
+    for name, cls in (('plain', OneToMultipleImage), ('additional_field', Captioned)):
+        serializer = cls(data[0])
+        rets[name] = {
+            'legacy': timed(lambda: [legacy(cls(obj), obj) for obj in data], repeat),
+            'current': timed(lambda: [cls(obj).data for obj in data], repeat),
+            'current_many': timed(lambda: cls(data, many=True).data, repeat),
+        }
+        assert [dict(ret) for ret in legacy(serializer, data[0])] == list(serializer.data)
+    return rets
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', type=int, default=1000)
+    parser.add_argument('--sizes', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    for name, times in run(args.images, args.sizes, args.repeat).items():
+        print(f"{name}: " + ', '.join(f'{key} {value * 1000:.1f}ms' for key, value in times.items()) +
+              f" (current {times['legacy'] / times['current']:.1f}x faster than legacy, serializer per image;"
+              f" many=True {times['current'] / times['current_many']:.1f}x faster than current per image)")
@@ -0,0 +1,235 @@
+# benchmark suite of resize/encode/save pipeline, runs offline with synthetic images. run from root of the repo like:
+#   python benchmarks/run.py --output results.json
+#   python benchmarks/run.py --output new.json --baseline results.json      (compare with a previous run)
+#   python benchmarks/run.py --cases upload_multipart --setting IMAGES_EXECUTOR="'thread'"
+# every case runs in its own process (with temp MEDIA_ROOT and sqlite db), so peak RSS of cases don't mix. input images
+# are generated in the parent and passed by temp files, peak RSS is of the timed loop (linux) or of the whole child
+import os
+import io
+import sys
+import json
+import time
+import base64
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import resource
+except ImportError:      # windows
+    resource = None
+
+CASES = ['upload_multipart', 'upload_base64', 'model_build', 'model_update', 'serializer']
+SIZES = ['120', '240', '480', '720', '960', '1280']
+MIME = {'JPEG': 'jpeg', 'PNG': 'png', 'WEBP': 'webp'}
+
+
+def setup(tmp, extra_settings):
+    import django
+    from django.conf import settings
+    from django.core.management import call_command
+    settings.configure(
+        BASE_DIR=tmp, MEDIA_ROOT=os.path.join(tmp, 'media'), MEDIA_URL='/media/', USE_TZ=True,
+        INSTALLED_APPS=['django.contrib.contenttypes', 'rest_framework', 'onetomultipleimage'],
+        DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(tmp, 'db.sqlite3')}},
+        DEFAULT_AUTO_FIELD='django.db.models.BigAutoField', **extra_settings)
+    django.setup()
+    call_command('migrate', verbosity=0)
+
+
+def synthetic_image(width, height, format, seed=0):
+    # gradients + noise, compresses like a photo (flat colors compress unrealistically well)
+    from PIL import Image
+    noise = Image.effect_noise((width, height), 48 + seed)
+    red = Image.linear_gradient('L').resize((width, height))
+    blue = Image.radial_gradient('L').resize((width, height))
+    image = Image.merge('RGB', (red, noise, blue))
+    buffer = io.BytesIO()
+    image.save(buffer, format=format)
+    return buffer.getvalue()
+
+
+def media_bytes(tmp):
+    total = 0
+    for root, dirs, names in os.walk(os.path.join(tmp, 'media')):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in names)
+    return total
+
+
+def prepare(case, raw, format, sizes, images):
+    # returns function that runs one iteration of the case, setup work (like creating image to update) isn't measured
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from onetomultipleimage.methods import ImageCreationSizes
+    from onetomultipleimage.models import FatherImage
+    name = f'bench.{format.lower()}'
+    if case == 'upload_multipart':
+        return lambda: ImageCreationSizes({'image': SimpleUploadedFile(name, raw)}, sizes).upload('bench/')
+    if case == 'upload_base64':
+        text = f'data:image/{MIME[format]};base64,' + base64.b64encode(raw).decode()
+        return lambda: ImageCreationSizes({'image': text}, sizes).upload('bench/')
+    if case == 'model_build':
+        return lambda: FatherImage(image=SimpleUploadedFile(name, raw), sizes=sizes).save()
+    if case == 'model_update':
+        father = FatherImage(image=SimpleUploadedFile(name, raw), sizes=sizes)
+        father.save()
+
+        def update():
+            father.image = SimpleUploadedFile(name, raw)
+            father.save()
+        return update
+    if case == 'serializer':
+        from bench_representation import images as fake_images
+        from onetomultipleimage.fields import OneToMultipleImage
+        data = fake_images(images, sizes)
+        return lambda: OneToMultipleImage(data, many=True).data
+    raise ValueError(f'unknown case {case}')
+
+
+def reset_peak_rss():
+    # linux only: resets peak RSS of the process (VmHWM), so setup before the timed loop isn't counted
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)     # bytes in macOS, KB in linux
+
+
+def run_case(case, resolution, format, count, repeat, images, extra_settings, input_path=None):
+    # runs inside child process, returns result dict. input_path is file of input image generated by parent
+    with tempfile.TemporaryDirectory() as tmp:
+        setup(tmp, extra_settings)
+        width, height = resolution
+        raw = b''
+        if input_path:
+            with open(input_path, 'rb') as f:
+                raw = f.read()
+        sizes = SIZES[:count]
+        function = prepare(case, raw, format, sizes, images)
+        written = media_bytes(tmp)
+        reset_peak_rss()
+        walls, cpus = [], []
+        for _ in range(repeat):
+            wall, cpu = time.perf_counter(), time.process_time()
+            function()
+            walls.append(time.perf_counter() - wall)
+            cpus.append(time.process_time() - cpu)
+        return {'case': case, 'resolution': f'{width}x{height}', 'format': format, 'sizes': count,
+                'input_bytes': len(raw), 'wall': statistics.median(walls), 'cpu': statistics.median(cpus),
+                'peak_rss_mb': peak_rss_mb(), 'bytes_written': (media_bytes(tmp) - written) // repeat}
+
+
+def key(result):
+    return result['case'], result['resolution'], result['format'], result['sizes']
+
+
+def compare(results, baseline, threshold):
+    # prints change of every metric against baseline, returns number of regressions (wall or cpu slower than threshold)
+    base = {key(result): result for result in baseline['results']}
+    regressions = 0
+    for result in results:
+        before = base.get(key(result))
+        if not before:
+            continue
+        changes = []
+        for metric in ('wall', 'cpu', 'peak_rss_mb', 'bytes_written'):
+            if before.get(metric) and result.get(metric) is not None:
+                change = result[metric] / before[metric] - 1
+                slower = metric in ('wall', 'cpu') and change > threshold
+                regressions += slower
+                changes.append(f"{metric} {change:+.0%}{' REGRESSION' if slower else ''}")
+        print(f"{'/'.join(str(part) for part in key(result))}: {', '.join(changes)}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmarks of onetomultipleimage')
+    parser.add_argument('--cases', default=','.join(CASES), help='comma separated, default: all of ' + ','.join(CASES))
+    parser.add_argument('--resolutions', default='640x480,1920x1080,4000x3000')
+    parser.add_argument('--formats', default='JPEG,PNG', help='formats of input images (JPEG, PNG, WEBP)')
+    parser.add_argument('--size-counts', default='1,3,6', help='number of generated sizes, up to 6')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--images', type=int, default=1000, help='number of images represented in serializer case')
+    parser.add_argument('--setting', action='append', default=[], help="django setting like: IMAGES_EXECUTOR=\"'thread'\"")
+    parser.add_argument('--output', help='file to save results as json')
+    parser.add_argument('--baseline', help='json file of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='slowdown counted as regression (0.2 means 20%%)')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--input', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    extra_settings = {name: eval(value) for name, value in (setting.split('=', 1) for setting in args.setting)}
+
+    if args.child:     # runs one case, prints its result
+        case, resolution, format, count = json.loads(args.child)
+        print(json.dumps(run_case(case, resolution, format, count, args.repeat, args.images, extra_settings, args.input)))
+        return
+
+    resolutions = [tuple(int(part) for part in resolution.split('x')) for resolution in args.resolutions.split(',')]
+    counts = [int(count) for count in args.size_counts.split(',')]
+    jobs = []
+    for case in args.cases.split(','):
+        if case == 'serializer':     # doesn't depend on input image
+            jobs += [(case, (0, 0), '-', count) for count in counts]
+        else:
+            jobs += [(case, resolution, format, count) for resolution in resolutions for format in args.formats.split(',')
+                     for count in counts]
+    results = []
+    with tempfile.TemporaryDirectory() as inputs:
+        for job in jobs:
+            case, (width, height), format, count = job
+            command = [sys.executable, os.path.abspath(__file__), '--child', json.dumps(job), '--repeat', str(args.repeat),
+                       '--images', str(args.images)] + [f'--setting={setting}' for setting in args.setting]
+            if case != 'serializer':      # generated once per resolution and format, not counted in rss of the case
+                path = os.path.join(inputs, f'{width}x{height}.{format.lower()}')
+                if not os.path.exists(path):
+                    with open(path, 'wb') as f:
+                        f.write(synthetic_image(width, height, format))
+                command += ['--input', path]
+            output = subprocess.run(command, capture_output=True, text=True)
+            if output.returncode:
+                sys.stderr.write(output.stderr)
+                sys.exit(f'{job} failed')
+            result = json.loads(output.stdout.strip().splitlines()[-1])
+            results.append(result)
+            print(f"{'/'.join(str(part) for part in key(result))}: wall {result['wall'] * 1000:.1f}ms, cpu {result['cpu'] * 1000:.1f}ms, "
+                  f"peak rss {result['peak_rss_mb']}MB, written {result['bytes_written']} bytes")
+
+    report = {'meta': {'python': platform.python_version(), 'platform': platform.platform(), 'settings': args.setting,
+                       'repeat': args.repeat, 'versions': versions()}, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"\ncompared with {args.baseline}:")
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+def versions():
+    import PIL
+    import django
+    import rest_framework
+    return {'pillow': PIL.__version__, 'django': django.get_version(), 'djangorestframework': rest_framework.VERSION}
+
+
+if __name__ == '__main__':
+    main()
@@ -3,4 +3,5 @@ from django.apps import AppConfig
 
 class OnetomultipleimageConfig(AppConfig):
     name = 'onetomultipleimage'
+    default_auto_field = 'django.db.models.BigAutoField'   # migrations are made with BigAutoField ids
     verbose_name = "One to Multiple Image"
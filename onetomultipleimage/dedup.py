@@ -0,0 +1,140 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils.module_loading import import_string
+
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def hash_key(stream, *params):
+    # sha256 of source image bytes + params (sizes, upload_to, ...) that change generated files.
+    # stream is read chunk by chunk and seeked back to start, so it can be decoded after that
+    sha = hashlib.sha256()
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(64 * 1024), b''):
+        sha.update(chunk)
+    stream.seek(0)
+    sha.update(json.dumps(params, default=str).encode())
+    return sha.hexdigest()
+
+
+class LRUIndex:
+    # in-process index. least recently used keys are evicted when more than max_size keys are stored, evicted keys are
+    # only forgotten (their files are kept), so next upload of that image generates its sizes again.
+    # reference counts are lost by eviction and restart and aren't seen by other processes, so it's not used by models
+    shared = False
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size if max_size else getattr(settings, 'IMAGES_DEDUP_LRU_SIZE', 1024)
+        self.entries = OrderedDict()     # like: {key: [names, refcount]}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry:
+                self.entries.move_to_end(key)
+                return list(entry[0])
+
+    def add(self, key, names):
+        # returns names stored for key. when key is already added (same image generated meanwhile), existing entry is
+        # acquired and its names are returned, so caller uses them and deletes its own files
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry:
+                entry[1] += 1
+            else:
+                entry = self.entries[key] = [list(names), 1]
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+            return list(entry[0])
+
+    def acquire(self, key):
+        # returns False when key is not in the index anymore (released or evicted after .get())
+        with self.lock:
+            if key in self.entries:
+                self.entries[key][1] += 1
+                return True
+        return False
+
+    def release(self, key):
+        # returns names of files aren't used anymore (should be deleted by caller), nothing for keys not in the index
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry:
+                entry[1] -= 1
+                if entry[1] <= 0:
+                    del self.entries[key]
+                    return entry[0]
+        return []
+
+    def discard(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+class DatabaseIndex:
+    # index stored in VariantIndex table, shared between processes and servers
+    shared = True
+
+    def get(self, key):
+        from .models import VariantIndex
+        names = VariantIndex.objects.filter(key=key).values_list('names', flat=True).first()
+        return list(names) if names else None
+
+    def add(self, key, names):
+        from .models import VariantIndex
+        # same as LRUIndex.add, concurrent uploads of the same image keep files of the first one
+        with transaction.atomic():
+            entry, created = VariantIndex.objects.select_for_update().get_or_create(key=key, defaults={'names': list(names), 'refcount': 1})
+            if not created:
+                VariantIndex.objects.filter(pk=entry.pk).update(refcount=F('refcount') + 1)
+        return list(entry.names)
+
+    def acquire(self, key):
+        from .models import VariantIndex
+        return bool(VariantIndex.objects.filter(key=key).update(refcount=F('refcount') + 1))
+
+    def release(self, key):
+        from .models import VariantIndex
+        with transaction.atomic():
+            entry = VariantIndex.objects.select_for_update().filter(key=key).first()
+            if not entry:
+                return []
+            if entry.refcount <= 1:
+                entry.delete()
+                return entry.names
+            VariantIndex.objects.filter(pk=entry.pk).update(refcount=F('refcount') - 1)
+        return []
+
+    def discard(self, key):
+        from .models import VariantIndex
+        VariantIndex.objects.filter(key=key).delete()
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(index=None, shared=False):
+    # index is 'db', 'lru', dotted path of index class, index object, False (disabled) or None (settings.IMAGES_DEDUP).
+    # returns None when deduplication is disabled. shared=True (files of models, their reference counts must outlive
+    # the process) returns only indexes shared between processes, custom index classes set `shared = True` for it
+    index = index if index is not None else getattr(settings, 'IMAGES_DEDUP', None)
+    if index and isinstance(index, str):
+        with _indexes_lock:
+            if index not in _indexes:
+                if index == 'db':
+                    _indexes[index] = DatabaseIndex()
+                elif index == 'lru':
+                    _indexes[index] = LRUIndex()
+                else:
+                    _indexes[index] = import_string(index)()
+            index = _indexes[index]
+    if not index or (shared and not getattr(index, 'shared', False)):
+        return None
+    return index
@@ -1,13 +1,16 @@
 from django import forms
 from django.db import models
 from rest_framework import serializers
-from rest_framework.utils.serializer_helpers import ReturnDict
+from rest_framework.utils.serializer_helpers import ReturnList
 
 import ast
 
+from PIL import UnidentifiedImageError
 from drf_extra_fields.fields import Base64ImageField
 
-from .methods import ImageCreationSizes
+from .methods import ImageCreationSizes, ImageTooLarge, InvalidImage, delete_uploads
+
+INVALID_IMAGE = (ImageTooLarge, InvalidImage, UnidentifiedImageError)    # errors of input image, shown as validation error of 'image'
 
 
 class ListCharField(models.CharField):
@@ -45,11 +48,38 @@ class ListCharFormField(forms.CharField):
         return value
 
 
+class OneToMultipleImageList(serializers.ListSerializer):
+    # OneToMultipleImage(many=True, ...), writes list of images like: [{'image': .., 'alt': ..}, ...] in parallel
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            raise serializers.ValidationError({'non_field_errors': ['Expected a list of items.']})
+        child = self.child
+        results = ImageCreationSizes.batch(data, child.sizes, child.upload_to, max_bytes=child.max_bytes, max_pixels=child.max_pixels,
+                                           storage=child.storage)
+        errors = [{'image': [str(error)]} if isinstance(error, INVALID_IMAGE) else {} for instances, error in results]
+        failed = next((error for instances, error in results if error), None)
+        if failed:             # files of other images of the request are already written
+            delete_uploads([obj for instances, error in results if instances for obj in instances], child.storage)
+            if not isinstance(failed, INVALID_IMAGE):
+                raise failed
+            raise serializers.ValidationError(errors)
+        return [[{'image': instance, 'alt': instance.alt, 'size': instance.size} for instance in instances]
+                for instances, error in results]
+
+    def to_representation(self, data):
+        # plan of child is looked up once for all images, instead of once per image
+        plan = self.child.get_plan()
+        return [self.child.represent(icons, plan) for icons in data]
+
+
 class OneToMultipleImage(serializers.BaseSerializer):
     image = Base64ImageField()  # deserialized version == SimpleUploadedFile(..), serialized == url
     alt = serializers.CharField(max_length=100, allow_blank=True, default='')
     size = serializers.CharField(max_length=10, allow_blank=True, required=False)
 
+    class Meta:
+        list_serializer_class = OneToMultipleImageList
+
     def base_data(self):  # this is 'def data' from BaseSerializer
         if hasattr(self, 'initial_data') and not hasattr(self, '_validated_data'):
             msg = (
@@ -73,10 +103,10 @@ class OneToMultipleImage(serializers.BaseSerializer):
 
     @property
     def data(self):        # make return list in to_representation without required passing 'many=True'
-        rets = self.base_data()
-        return [ReturnDict(ret, serializer=self) for ret in rets]
+        return ReturnList(self.base_data(), serializer=self)
 
-    def __init__(self, instance=None, sizes=None, upload_to=None, *args, **kwargs):
+    def __init__(self, instance=None, sizes=None, upload_to=None, max_bytes=None, max_pixels=None, storage=None, *args, **kwargs):
+        # max_bytes, max_pixels: limits of input image, storage: where images are written, see ImageCreationSizes
         super().__init__(*args, **kwargs)
         self.instance = instance   # self.instance overrides to None in super().__init__, so use after super().__init__
         if not self.instance:      # in writing, sizes and upload_to required
@@ -84,34 +114,62 @@ class OneToMultipleImage(serializers.BaseSerializer):
                 raise ValueError("both of 'sizes' and 'upload_to' arguments must be provided")
             self.sizes = sizes
             self.upload_to = upload_to
-
-    def to_representation(self, obj):
-        additional_fields = {field_name: field for field_name, field in self.get_fields().items() if field_name not in ['image', 'alt', 'size']}
+            self.max_bytes, self.max_pixels, self.storage = max_bytes, max_pixels, storage
+
+    @classmethod
+    def get_plan(cls):
+        # additional fields of subclasses (other than image, alt, size) like: [('author', 'serializer', field), ...],
+        # found once per serializer class. BaseSerializer has no .get_fields(), fields are class attributes here
+        plan = cls.__dict__.get('_plan')
+        if plan is None:
+            fields = {}
+            for klass in reversed(cls.__mro__):
+                fields.update({name: value for name, value in vars(klass).items() if isinstance(value, serializers.Field)})
+            plan = []
+            for field_name, field in fields.items():
+                if field_name in ('image', 'alt', 'size'):
+                    continue
+                if isinstance(field, serializers.SerializerMethodField):
+                    plan.append((field_name, 'method', field.method_name or f'get_{field_name}'))
+                elif isinstance(field, serializers.BaseSerializer):      # field is a serializer like author field
+                    plan.append((field_name, 'serializer', field))
+                else:                                                   # field is normal field like CharField, ...
+                    plan.append((field_name, 'field', field))
+            cls._plan = plan
+        return plan
+
+    def represent(self, icons, plan):
+        # icons are dicts (like validated_data) or objects (like Upload objects, ImageSizes) of sizes of one image
+        if not plan:            # no additional fields (most common)
+            return [{'image': icon['image'].url, 'alt': icon.get('alt', ''), 'size': icon.get('size', '')} if isinstance(icon, dict) else
+                    {'image': icon.url, 'alt': getattr(icon, 'alt', ''), 'size': getattr(icon, 'size', '')} for icon in icons]
         rets = []
-        if isinstance(obj[0], dict):
-            for icon in obj:
+        for icon in icons:
+            is_dict = isinstance(icon, dict)
+            if is_dict:
                 ret = {'image': icon['image'].url, 'alt': icon.get('alt', ''), 'size': icon.get('size', '')}
-
-                for field_name, field in additional_fields.items():  # add additional fields value to ret if provided
-                    if icon.get(field_name):
-                        if isinstance(field, serializers.SerializerMethodField):
-                            method = getattr(self, f'get_{field_name}')
-                            if method(instance):  # prevent 'None' value came to db in SerializerMethodField fields
-                                ret[field_name] = method(instance)
-                        elif isinstance(field, serializers.BaseSerializer):  # field is a serializer like author field
-                            field.instance = icon[field_name]
-                            ret[field_name] = field.data
-                        else:  # field is normal field like CharField, ...
-                            ret[field_name] = field.to_representation(icon[field_name])
-
-                rets.append(ret)
-        else:
-            for icon in obj:
-                rets.append(super().to_representation(icon))
+            else:
+                ret = {'image': icon.url, 'alt': getattr(icon, 'alt', ''), 'size': getattr(icon, 'size', '')}
+            for field_name, kind, field in plan:      # add additional fields value to ret if provided
+                if kind == 'method':
+                    value = getattr(self, field)(icon)
+                    if value:          # prevent 'None' value came to db in SerializerMethodField fields
+                        ret[field_name] = value
+                else:
+                    value = icon.get(field_name) if is_dict else getattr(icon, field_name, None)
+                    if value:
+                        ret[field_name] = field.to_representation(value)
+            rets.append(ret)
         return rets
 
+    def to_representation(self, obj):
+        return self.represent(obj, self.get_plan())
+
     def to_internal_value(self, data):
-        obj = ImageCreationSizes(data=data, sizes=self.sizes)
-        instances = obj.upload(upload_to=self.upload_to)
+        obj = ImageCreationSizes(data=data, sizes=self.sizes, max_bytes=self.max_bytes, max_pixels=self.max_pixels, storage=self.storage)
+        try:
+            instances = obj.upload(upload_to=self.upload_to)
+        except INVALID_IMAGE as e:
+            raise serializers.ValidationError({'image': [str(e)]})
         return [{'image': instance, 'alt': instance.alt, 'size': instance.size} for instance in instances]
 
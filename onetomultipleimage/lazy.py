@@ -0,0 +1,62 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+import time
+import threading
+
+from .workers import reclaim_stale
+
+# requests of the same size in one process wait for each other here, requests of other processes wait in db (status)
+_locks = [threading.Lock() for i in range(64)]
+
+
+class RenderError(Exception):
+    pass
+
+
+def get_cache():
+    # render cache, file names of generated sizes by (father_id, size). default is 'default' cache of the project
+    return caches[getattr(settings, 'IMAGES_LAZY_CACHE', 'default')]
+
+
+def cache_key(father_id, size):
+    return f'onetomultipleimage:{father_id}:{size}'
+
+
+def invalidate_render_cache(father_id, sizes):
+    get_cache().delete_many([cache_key(father_id, size) for size in sizes])
+
+
+def get_size(father_id, size, timeout=30, interval=0.1):
+    # returns file name of the size of FatherImage, the file is generated if it's not generated yet (lazy or pending
+    # status). raises ImageSizes.DoesNotExist when FatherImage has not this size
+    from .models import ImageSizes
+    cache, key = get_cache(), cache_key(father_id, size)
+    name = cache.get(key)
+    if name:
+        return name
+    with _locks[hash(key) % len(_locks)]:
+        instance = ImageSizes.objects.select_related('father').get(father_id=father_id, size=size)
+        if instance.status == ImageSizes.PROCESSING and reclaim_stale(pk=instance.pk):    # its renderer was killed
+            instance.status = ImageSizes.PENDING
+        if instance.status in (ImageSizes.LAZY, ImageSizes.PENDING):
+            # claim it, only one request (of any process) generates the size
+            if ImageSizes.objects.filter(pk=instance.pk, status=instance.status).update(status=ImageSizes.PROCESSING,
+                                                                                        claimed_at=timezone.now()):
+                previous, instance.status = instance.status, ImageSizes.PROCESSING
+                try:
+                    instance.father.render_pending([instance])
+                except Exception:
+                    ImageSizes.objects.filter(pk=instance.pk).update(status=previous)   # next request tries again
+                    raise
+        start = time.monotonic()
+        while instance.status in (ImageSizes.PROCESSING, ImageSizes.PENDING, ImageSizes.LAZY):  # generated by others
+            if time.monotonic() - start >= timeout:
+                raise RenderError(f'generating size {size} of image {father_id} timed out')
+            time.sleep(interval)
+            instance.refresh_from_db(fields=['image', 'status'])
+        if instance.status != ImageSizes.READY:
+            raise RenderError(f'generating size {size} of image {father_id} failed')
+    cache.set(key, instance.image.name, getattr(settings, 'IMAGES_LAZY_CACHE_TIMEOUT', None))
+    return instance.image.name
@@ -0,0 +1,106 @@
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, models, transaction
+
+import os
+import uuid
+
+from onetomultipleimage.methods import ImageCreationSizes, get_executor
+from onetomultipleimage.models import FatherImage, ImageSizes
+
+EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.gif', '.bmp', '.tif', '.tiff')
+
+
+def render(path, sizes):
+    # runs in worker threads: generates and writes files of one image, returns unsaved (FatherImage, [ImageSizes])
+    # alt is a full uuid (alts are unique, 6 hex digits of default alt collide at catalogue scale)
+    with open(path, 'rb') as f:
+        img = ImageCreationSizes(data={'image': File(f), 'alt': uuid.uuid4().hex}, sizes=sizes, executor=False)
+        instances = img.build(model=ImageSizes, upload_to=ImageSizes._meta.get_field('image').upload_to)
+        for instance, size in zip(instances, sizes):
+            instance.size = size
+            if not instance.image._committed:
+                instance.image.save(instance.image.name, instance.image.file, save=False)
+        father = FatherImage(alt=ImageCreationSizes.add_size_to_alt('default', img.alt), sizes=sizes)
+        f.seek(0)
+        father.image.save(os.path.basename(path), File(f), save=False)
+        father.manifest = father.build_manifest(instances, img.source_size)    # saved by bulk_create with father
+    return father, instances, img
+
+
+class Command(BaseCommand):
+    help = 'imports images of a directory to FatherImage/ImageSizes, already imported images are skipped (resumable)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory')
+        parser.add_argument('--sizes', required=True, help="comma separated sizes like: 120,240,default")
+        parser.add_argument('--workers', type=int, default=None, help='number of threads generate images')
+        parser.add_argument('--chunk-size', type=int, default=100, help='images saved to db per transaction')
+        parser.add_argument('--state', default=None, help='file of imported paths (default: <directory>/.imported)')
+
+    def handle(self, *args, **options):
+        directory, sizes = options['directory'], options['sizes'].split(',')
+        if not os.path.isdir(directory):
+            raise CommandError(f'{directory} is not a directory')
+        state = options['state'] or os.path.join(directory, '.imported')
+        imported = set()
+        if os.path.exists(state):
+            with open(state) as f:
+                imported = set(line.rstrip('\n') for line in f)
+        paths = sorted(os.path.join(root, name) for root, dirs, names in os.walk(directory) for name in names
+                       if name.lower().endswith(EXTENSIONS) and os.path.relpath(os.path.join(root, name), directory) not in imported)
+        executor = get_executor('thread', options['workers'])
+        done = failed = 0
+        for i in range(0, len(paths), options['chunk_size']):
+            chunk = paths[i:i + options['chunk_size']]
+            futures = [executor.submit(render, path, sizes) for path in chunk]
+            rendered = []
+            for path, future in zip(chunk, futures):
+                try:
+                    rendered.append((path, *future.result()))
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f'{path}: {e}')
+            try:
+                with transaction.atomic():
+                    self.save(rendered)
+            except Exception:        # saved one by one, so only failed images are skipped
+                saved = []
+                for item in rendered:
+                    try:
+                        with transaction.atomic():
+                            self.save([item])
+                        saved.append(item)
+                    except Exception as e:
+                        failed += 1
+                        self.stderr.write(f'{item[0]}: {e}')
+                        self.discard(*item)
+                rendered = saved
+            with open(state, 'a') as f:
+                f.writelines(os.path.relpath(path, directory) + '\n' for path, *_ in rendered)
+            done += len(rendered)
+            self.stdout.write(f'{done}/{len(paths)} imported')
+        self.stdout.write(self.style.SUCCESS(f'{done} images imported, {failed} failed, {len(imported)} skipped'))
+
+    def save(self, rendered):
+        fathers = [father for path, father, instances, img in rendered]
+        if connection.features.can_return_rows_from_bulk_insert:
+            FatherImage.objects.bulk_create(fathers)
+        else:           # pks of bulk_create aren't returned, FatherImage.save isn't used (sizes are generated already)
+            for father in fathers:
+                models.Model.save(father)
+        for path, father, instances, img in rendered:
+            for instance in instances:
+                instance.father = father
+        ImageSizes.objects.bulk_create([instance for path, father, instances, img in rendered for instance in instances])
+        for path, father, instances, img in rendered:
+            father.set_variants_key(img, instances)
+
+    def discard(self, path, father, instances, img):
+        # deletes written files of an image failed to save, files reused from dedup index are shared with other images
+        father.image.delete(save=False)
+        if not img.dedup_hit:
+            storage = ImageSizes._meta.get_field('image').storage
+            for instance in instances:
+                for name in [instance.image.name, *instance.formats.values()]:
+                    storage.delete(name)
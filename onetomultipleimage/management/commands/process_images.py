@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from onetomultipleimage.workers import DatabaseWorker
+
+
+class Command(BaseCommand):
+    help = "generates files of pending ImageSizes (deferred mode with IMAGES_WORKER = 'db')"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=1, help='seconds between polls when nothing is pending')
+        parser.add_argument('--limit', type=int, default=100, help='max images processed per poll')
+        parser.add_argument('--once', action='store_true', help='process pending images once and exit')
+
+    def handle(self, *args, **options):
+        worker = DatabaseWorker()
+        if options['once']:
+            processed = worker.run_once(options['limit'])
+            self.stdout.write(f'{processed} images processed')
+        else:
+            worker.run(options['interval'], options['limit'])
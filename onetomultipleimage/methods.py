@@ -1,25 +1,420 @@
 from django.conf import settings
-from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadedfile import UploadedFile, InMemoryUploadedFile
 
 import io
-import os
+import time
 import uuid
+import base64
+import tempfile
 import itertools
-from datetime import datetime
-from PIL import Image as PilImage
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from PIL import Image as PilImage, ImageOps
+
+from .dedup import get_index, hash_key
+from .storage import get_storage, BatchWriter
+from .metrics import measure, emit, enabled as metrics_enabled
+from . import paths
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(kind, max_workers=None):
+    # kind is 'thread', 'process' or None (None means resize sizes one after another in the caller's thread).
+    # pools are created once and shared between uploads, creating a pool per request costs more than the resizing
+    if not kind:
+        return None
+    key = (kind, max_workers)
+    with _executors_lock:
+        if key not in _executors:
+            if kind == 'thread':
+                _executors[key] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='onetomultipleimage')
+            elif kind == 'process':
+                _executors[key] = ProcessPoolExecutor(max_workers=max_workers)
+            else:
+                raise ValueError("'executor' must be one of 'thread', 'process' or None")
+        return _executors[key]
+
+
+class ImageTooLarge(ValueError):
+    # raised before decoding, when payload bytes or image pixels are more than allowed limits
+    pass
+
+
+class InvalidImage(ValueError):
+    # image of an item of batch() is missing or can't be read (like a str that isn't base64)
+    pass
+
+
+def decode_base64(text, max_bytes=None, chunk_size=1024 * 1024):
+    # decodes base64 str like: "data:image/jpeg;base64,/9j/..." chunk by chunk to a spooled temp file (kept in memory
+    # until settings.FILE_UPLOAD_MAX_MEMORY_SIZE, then moved to disk), so decoded bytes are never held in memory at once
+    start = text.index(';base64,') + len(';base64,')
+    if max_bytes and (len(text) - start) * 3 // 4 > max_bytes + 2:     # estimate of decoded size, before decoding
+        raise ImageTooLarge(f'image is bigger than {max_bytes} bytes')
+    spooled = tempfile.SpooledTemporaryFile(max_size=getattr(settings, 'FILE_UPLOAD_MAX_MEMORY_SIZE', 2621440))
+    pending, written = '', 0
+    for i in range(start, len(text), chunk_size):
+        piece = pending + ''.join(text[i:i + chunk_size].split())    # base64 can be wrapped by new lines
+        cut = len(piece) - len(piece) % 4
+        pending = piece[cut:]
+        written += spooled.write(base64.b64decode(piece[:cut]))
+        if max_bytes and written > max_bytes:
+            spooled.close()
+            raise ImageTooLarge(f'image is bigger than {max_bytes} bytes')
+    if pending:
+        spooled.write(base64.b64decode(pending + '=' * (-len(pending) % 4)))
+    spooled.seek(0)
+    return spooled
+
+
+def open_stream(image, max_bytes=None):
+    # returns file like object of image without copying it. image can be file (uploaded file, image field) or base64 str
+    if isinstance(image, str):
+        return decode_base64(image, max_bytes)
+    size = getattr(image, 'size', None)    # uploaded files are already on disk/memory, only check their size
+    if max_bytes and size and size > max_bytes:
+        raise ImageTooLarge(f'image is bigger than {max_bytes} bytes')
+    image.seek(0)
+    return image
+
+
+def check_pixels(opened_image, max_pixels=None):
+    # PilImage.open only reads image header, so this runs before decoding the bitmap
+    if max_pixels and opened_image.size[0] * opened_image.size[1] > max_pixels:
+        raise ImageTooLarge(f'image has more than {max_pixels} pixels')
+
+
+def open_image(stream, max_pixels=None):
+    # PilImage.open (only reads header) with pixels limit, max_pixels or decompression bomb limit of pillow
+    # (PIL.Image.MAX_IMAGE_PIXELS). pillow still rejects images more than 2 * MAX_IMAGE_PIXELS (raise it or set it None
+    # for bigger ones). warnings filters aren't touched (they are process wide), so pillow may still warn about big images
+    try:
+        image = PilImage.open(stream)
+    except PilImage.DecompressionBombError as e:       # more than 2 * MAX_IMAGE_PIXELS
+        limit = PilImage.MAX_IMAGE_PIXELS
+        raise ImageTooLarge(f'image has more than {max_pixels} pixels' if max_pixels and max_pixels < 2 * limit else str(e))
+    check_pixels(image, max_pixels or PilImage.MAX_IMAGE_PIXELS)
+    return image
+
+
+def normalize_mode(image):
+    # converts image to a mode resizing and encoding work well with ('1', 'L', 'LA', 'RGB', 'RGBA')
+    if image.mode in ('1', 'L', 'LA', 'RGB', 'RGBA'):
+        return image
+    if image.mode in ('P', 'PA'):         # palette is resized badly (nearest only)
+        return image.convert('RGBA' if image.mode == 'PA' or 'transparency' in image.info else 'RGB')
+    if image.mode.startswith('I;16'):     # 16 bit grayscale (like some png/tiff)
+        return image.convert('I').point(lambda value: value * (1 / 256)).convert('L')
+    if image.mode in ('I', 'F'):
+        return image.convert('L')
+    return image.convert('RGB')           # CMYK, YCbCr, LAB, HSV
+
+
+class DecodedImage:
+    # decode stage of the input image. the image is opened once (only header, pixel limit is checked before decoding)
+    # and decoded on first .get() with EXIF orientation applied and mode normalized, next .get() calls reuse it.
+    # jpeg is decoded in reduced scale (draft) when only small sizes are needed, and decoded again if a bigger one is
+    # requested later. can be passed as `opened_image` to build/update/upload, see also decode_image()
+    def __init__(self, source, max_pixels=None):
+        # source is file like object of the image (stream) or PilImage
+        self.max_pixels = max_pixels
+        if isinstance(source, PilImage.Image):
+            self.stream, self._header = None, source
+            check_pixels(source, max_pixels)
+        else:
+            self.stream, self._header = source, open_image(source, max_pixels)
+        self.format = self._header.format
+        self.orientation = self._header.getexif().get(0x0112, 1)      # exif orientation tag
+        width, height = self._header.size
+        self.size = (height, width) if self.orientation in (5, 6, 7, 8) else (width, height)   # size after orientation
+        self.image, self.full = None, False
+        self.lock = threading.Lock()
+
+    def _open(self):
+        # not decoded PilImage of the source (draft only works on not decoded images)
+        header, self._header = self._header, None
+        if header is not None:
+            return header
+        if getattr(self.stream, 'closed', False):
+            self.stream.open('rb')
+        self.stream.seek(0)
+        return open_image(self.stream, self.max_pixels)
+
+    def get(self, min_size=None):
+        # returns decoded PilImage at least min_size (width, height) big, or in full size when min_size is None
+        with self.lock:
+            if self.image is not None and (self.full or (min_size and self.image.size[0] >= min_size[0] and self.image.size[1] >= min_size[1])):
+                return self.image
+            if self.stream is None and self._header is None:    # PilImage source can't be decoded again
+                return self.image
+            image = self._open()
+            if min_size and self.stream is not None and image.format == 'JPEG':
+                width, height = min_size[::-1] if self.orientation in (5, 6, 7, 8) else min_size
+                image.draft(image.mode, (int(width), int(height)))
+            image.load()
+            if self.orientation != 1:
+                image = ImageOps.exif_transpose(image)
+            self.image = normalize_mode(image)
+            self.full = self.image.size == self.size
+            return self.image
+
+    def release(self):
+        # frees decoded bitmap (next .get() decodes again)
+        with self.lock:
+            self.image, self.full = None, False
+
+    def rebind(self, stream):
+        # next decodes read the same image from stream (like the stored file of an uploaded file, which may be closed later)
+        with self.lock:
+            self.stream, self._header = stream, None
+
+
+def decode_image(image, stream=None, max_pixels=None):
+    # DecodedImage of file or base64 str. it's cached on file objects (uploaded file of a request, FatherImage.image),
+    # so sizes generated again from the same file (updating, admin actions, serializer + model) don't decode it again.
+    # a file assigned to image field shares the cache with the field's file
+    decoded = cached_decode(image)
+    if decoded is not None:
+        check_pixels(decoded, max_pixels)
+        return decoded
+    decoded = DecodedImage(stream if stream is not None else open_stream(image), max_pixels)
+    if not isinstance(image, str):
+        image.decoded_image = decoded
+    return decoded
+
+
+def cached_decode(image):
+    # DecodedImage cached on file object by decode_image(), or None
+    for file in (image, getattr(image, '_file', None)):
+        decoded = getattr(file, 'decoded_image', None)
+        if decoded is not None:
+            return decoded
+    return None
+
+
+class LazyUploadedFile(UploadedFile):
+    # uploaded file backed by the file written to storage, the file opens on first access (.read(), .open(), ...)
+    # instead of holding a second copy of the image bytes in memory. closed file is reopened on next access.
+    # storage_name is name of the file in storage like: 'posts_images/1402/3/20/qwer43asd2e4-720.JPEG'
+    def __init__(self, storage, storage_name, content_type=None, size=None):
+        self.storage, self.storage_name = storage, storage_name
+        super().__init__(None, storage_name.rsplit('/', 1)[-1], content_type, size)
+
+    @property
+    def size(self):
+        if self._size is None:      # not known for reused files (dedup), asked from storage only when needed
+            self._size = self.storage.size(self.storage_name)
+        return self._size
+
+    @size.setter
+    def size(self, size):
+        self._size = size
+
+    @property
+    def file(self):
+        if self._file is None or self._file.closed:
+            self._file = self.storage.open(self.storage_name, 'rb')
+        return self._file
+
+    @file.setter
+    def file(self, file):
+        self._file = file
+
+    def open(self, mode=None):
+        self.file.seek(0)
+        return self
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+def check_format(format):
+    # True if pillow can write the format. AVIF needs pillow >= 11.3 or 'pillow-avif-plugin' package
+    PilImage.init()
+    if format not in PilImage.SAVE and format == 'AVIF':
+        try:
+            import pillow_avif  # noqa: F401, registers AVIF to pillow
+        except ImportError:
+            return False
+    return format in PilImage.SAVE
+
+
+def output_options(output, size):
+    # output is like: {'format': 'WEBP', 'quality': 80, 'sizes': {'default': {'format': None}}} (see IMAGES_OUTPUT),
+    # returns options of the size (overridden by output['sizes'][size])
+    if not output:
+        return {}
+    options = {key: value for key, value in output.items() if key != 'sizes'}
+    options.update(output.get('sizes', {}).get(size, {}))
+    return options
+
+
+def encode(opened_image, format, options=None):
+    # encodes image once, the same buffer is written to disk or passed to the image field.
+    # options like: {'quality': 80, 'optimize': True, 'progressive': True, 'strip_metadata': True}
+    options, params = options or {}, {}
+    if options.get('quality'):
+        params['quality'] = options['quality']
+    if options.get('optimize'):
+        params['optimize'] = True
+    if options.get('progressive'):
+        params['progressive'] = True
+    if options.get('strip_metadata'):
+        params['exif'], params['icc_profile'] = b'', None
+    if format == 'JPEG' and opened_image.mode not in ('RGB', 'L', 'CMYK'):     # like png with alpha converted to jpeg
+        opened_image = opened_image.convert('RGB')
+    buffer = io.BytesIO()
+    opened_image.save(buffer, format=format, **params)
+    buffer.seek(0)
+    return buffer
+
+
+def encode_size(opened_image, format, options=None):
+    # returns [(format, buffer), ...] of all outputs of a size, first one is the main format (saved in image field),
+    # others are options['formats'] (not available formats like AVIF without plugin are skipped). main format falls
+    # back to format of the source image when pillow can't write it
+    options = options or {}
+    main = (options.get('format') or format).upper()
+    main = main if check_format(main) else format.upper()
+    formats = [main] + [extra.upper() for extra in options.get('formats', []) if extra.upper() != main and check_format(extra.upper())]
+    return [(format, encode(opened_image, format, options)) for format in formats]
+
+
+def resize(opened_image, height, aspect_ratio):
+    # height is like: '120' or 'default'. returns (height, resized image), height is int for digit sizes
+    if height.isdigit():
+        height = int(height)
+        return height, opened_image.resize((height, int(height / aspect_ratio)))
+    return height, opened_image  # for 'default' size
+
+
+def size_dimensions(size, source_size):
+    # (width, height) of a generated size of image with source_size (width, height), same as what resize() returns
+    if size.isdigit():
+        return int(size), int(int(size) / (source_size[0] / source_size[1]))
+    return tuple(source_size)
+
+
+def plan_resizes(sizes, cascade_factor=None):
+    # groups indexes of sizes to chains like: [[0, 2], [1], [3]]. first size of every chain is resized from the source
+    # image, next ones from the previous (bigger) result of the chain instead of the source. a size only continues a
+    # chain when previous result is at least `cascade_factor` times bigger than it (quality guard). chains are
+    # independent and can be resized in parallel. cascade_factor=None means no cascading (every size its own chain)
+    chains = [[index] for index, size in enumerate(sizes) if not size.isdigit()]    # 'default' is never resized
+    digits = sorted((index for index, size in enumerate(sizes) if size.isdigit()), key=lambda index: -int(sizes[index]))
+    tails = []               # [(last size of chain, chain), ...]
+    for index in digits:
+        size = int(sizes[index])
+        candidates = [tail for tail in tails if cascade_factor and tail[0] >= size * cascade_factor]
+        if candidates:        # best fit: continue the chain with the smallest acceptable previous result
+            tail = min(candidates, key=lambda tail: tail[0])
+            tail[1].append(index)
+            tails.remove(tail)
+            tails.append((size, tail[1]))
+        else:
+            chain = [index]
+            chains.append(chain)
+            tails.append((size, chain))
+    return chains
+
+
+def needed_size(sizes, aspect_ratio, cascade_factor=None):
+    # smallest (width, height) of source the sizes can be generated from without quality loss (at least
+    # `cascade_factor` times bigger than the biggest size), None means the full source is needed
+    if not cascade_factor or not sizes or not all(size.isdigit() for size in sizes):   # 'default' needs source as is
+        return None
+    width = max(int(size) for size in sizes) * cascade_factor
+    return width, width / aspect_ratio
+
+
+def prepare_source(opened_image, sizes, aspect_ratio, cascade_factor=None):
+    # shrinks the source before resizing when the biggest requested size is much smaller than it. jpeg is decoded
+    # directly in reduced scale (draft, only works on not loaded images), other formats are reduced by integer factor.
+    # opened_image is DecodedImage or PilImage, returns decoded PilImage
+    needed = needed_size(sizes, aspect_ratio, cascade_factor)
+    if isinstance(opened_image, DecodedImage):
+        opened_image = opened_image.get(needed)
+    elif needed and opened_image.format == 'JPEG':       # no effect when image is already loaded
+        opened_image.draft(opened_image.mode, (int(needed[0]), int(needed[1])))
+    if not needed:
+        return opened_image
+    width, height = needed
+    factor = int(min(opened_image.size[0] / width, opened_image.size[1] / height))
+    if factor >= 2 and opened_image.mode in ('L', 'LA', 'RGB', 'RGBA'):
+        return opened_image.reduce(factor)
+    return opened_image
+
+
+def resize_encode(opened_image, chain, aspect_ratio, format):
+    # used by process pool (must be module level to be picklable), chain is like: [(0, '480', options), (2, '240', options)]
+    # returns [(index, height, [(format, encoded bytes), ...], timings), ...] instead of PilImage, timings are like:
+    # {'resize': seconds, 'encode': seconds, 'pixels': 14400} (metrics can't be sent from other processes)
+    rets = []
+    for index, height, options in chain:
+        start = time.perf_counter()
+        height, opened_image = resize(opened_image, height, aspect_ratio)
+        resized = time.perf_counter()
+        outputs = [(format, buffer.getvalue()) for format, buffer in encode_size(opened_image, format, options)]
+        timings = {'resize': resized - start, 'encode': time.perf_counter() - resized, 'pixels': opened_image.size[0] * opened_image.size[1]}
+        rets.append((index, height, outputs, timings))
+    return rets
+
+
+class Upload:
+    # returned objects of ImageCreationSizes.upload()
+    def __init__(self, image, url, alt, size, **kwargs):
+        kwargs['image'], kwargs['url'], kwargs['alt'], kwargs['size'] = image, url, alt, size
+        [setattr(self, key, kwargs[key]) for key in kwargs]
+
+    def __repr__(self):
+        return '<Upload object {} - (.image .url .alt .size)>'.format(self.alt)  # self.alt contain size too
+
+
+def delete_uploads(objects, storage=None, dedup=None):
+    # deletes files of upload objects (like when other images of the same request failed). with dedup they may be
+    # shared by other uploads of the same image, so they are kept
+    if get_index(dedup):
+        return
+    storage = get_storage(storage)
+    for obj in objects:
+        for name in [obj.name, *[other.name for other in getattr(obj, 'formats', {}).values()]]:
+            storage.delete(name)
 
 
 class ImageCreationSizes:
     # in this class we receive image binary/base64 and save it to disk with specified sizes. if a model specified,
     # that models field will be filled instead, for example: image1.image = size1, image2.image = size2, ...
-    def __init__(self, data, sizes, name=None):
+    def __init__(self, data, sizes, name=None, executor=None, max_workers=None, cascade_factor=None,
+                 max_bytes=None, max_pixels=None, dedup=None, output=None, storage=None):
         # data is like: {'image': InMemoryUploadFIle(..)} (keys are instance fields). 'image' can be Base64 str too.
-        # sizes like:
+        # sizes like: ['120', '240', 'default']
+        # executor is 'thread' or 'process' to resize sizes in parallel (False: one by one), default is settings.IMAGES_EXECUTOR
+        # cascade_factor, see plan_resizes, default is settings.IMAGES_CASCADE_FACTOR (2), 0 disables it
+        # max_bytes, max_pixels limit the input image, default is settings.IMAGES_MAX_UPLOAD_SIZE, IMAGES_MAX_PIXELS
+        # dedup is index of already generated sizes ('db', 'lru', ...), default is settings.IMAGES_DEDUP, see dedup.py
+        # output is format and encoder options of sizes, default is settings.IMAGES_OUTPUT, see output_options()
+        # storage is where .upload() writes files (Storage object or alias of settings.STORAGES), see storage.py
         self.base_path = str(settings.BASE_DIR)  # is like: /home/akh/eCommerce-web-api/ictsun
         self.data = data.copy()  # we don't want change outside variables has been passed to our class.
         self.sizes = sizes
         self.name = name if name else uuid.uuid4().hex[:12]
         self.uuid_alt = False
+        self.executor = executor if executor is not None else getattr(settings, 'IMAGES_EXECUTOR', None)
+        self.max_workers = max_workers if max_workers else getattr(settings, 'IMAGES_EXECUTOR_WORKERS', None)
+        self.cascade_factor = cascade_factor if cascade_factor is not None else getattr(settings, 'IMAGES_CASCADE_FACTOR', 2)
+        self.max_bytes = max_bytes if max_bytes else getattr(settings, 'IMAGES_MAX_UPLOAD_SIZE', None)
+        self.max_pixels = max_pixels if max_pixels else getattr(settings, 'IMAGES_MAX_PIXELS', None)
+        self.dedup = dedup
+        self.output = output if output is not None else getattr(settings, 'IMAGES_OUTPUT', None)
+        self.dedup_key, self.dedup_hit = None, False     # filled in .save() when dedup is enabled
+        self.source_size = None                          # (width, height) of input image, filled in .save()
+        self.metrics = False                             # True when stages are measured, see metrics.py
+        self.storage = get_storage(storage)
+        self.writer = BatchWriter(self.storage)     # files of .upload() are written together after rendering all sizes
         # when data is like: {'alt': None, ...}, data['alt'] must be removed and replaced with uuid
         try:
             alt = self.data.pop('alt')
@@ -42,36 +437,106 @@ class ImageCreationSizes:
 
     def get_path(self, middle_path=None):
         # get path like: '/media/posts_images/icons/' returns like: '/media/posts_images/icons/1402/3/15/'
+        # (directory depends on settings.IMAGES_NAMING, see paths.py)
         if not middle_path:
             middle_path = 'posts_images/icons/'
-        middle_path = '/media/' + middle_path
-        if getattr(settings, 'IMAGES_PATH_TYPE', None) == 'jalali':
-            try:
-                import jdatetime
-                date = jdatetime.datetime.fromgregorian(date=datetime.now()).strftime('%Y %-m %-d').split()
-            except ImportError:
-                raise ImportError("please install 'jdatetime' package")
-        else:
-            now = datetime.now()
-            date = f"{now.year} {now.month} {now.day}".split()     # %Y %-m %-d format doesn't work in windows
-        return f'{middle_path}/{date[0]}/{date[1]}/{date[2]}/'
+        return paths.directory('/media/' + middle_path, self.name)
 
     def _save(self, opened_image, full_name, format, instance, att_name, upload_to=None):
+        # opened_image can be PilImage or already encoded content (bytes or BytesIO, like what process pool returns)
         if isinstance(opened_image, PilImage.Image):
-            if instance:           # save image by image field (need write to disk)
-                buffer = io.BytesIO()
-                opened_image.save(buffer, format=format)
-                setattr(instance, att_name, SimpleUploadedFile(full_name, buffer.getvalue()))
-                # field.upload_to must change to our path, also '/media/' must remove from path otherwise raise error
-                if upload_to:
-                    if callable(upload_to):    # if upload_to is function
-                        getattr(instance, att_name).field.upload_to = upload_to
-                    else:                      # if is string
-                        getattr(instance, att_name).field.upload_to = upload_to.replace('/media/', '', 1)
-                return None
-            else:                  # save image (write to disk) by pillow.save()
-                opened_image.save(self.base_path + upload_to + full_name)
-                return SimpleUploadedFile(full_name, open(self.base_path + upload_to + full_name, 'rb').read())
+            buffer = encode(opened_image, format)
+        elif isinstance(opened_image, bytes):
+            buffer = io.BytesIO(opened_image)
+        else:
+            buffer = opened_image
+        size = buffer.getbuffer().nbytes
+        content_type = PilImage.MIME.get(format.upper())
+        if instance:           # save image by image field (image field writes the buffer to disk)
+            setattr(instance, att_name, InMemoryUploadedFile(buffer, att_name, full_name, content_type, size, None))
+            self._set_upload_to(instance, att_name, upload_to)
+            return None
+        else:                  # the encoded bytes are written to storage by self.writer (see _save_stream)
+            self.writer.add(upload_to + full_name, buffer)
+            return None
+
+    @staticmethod
+    def _set_upload_to(instance, att_name, upload_to):
+        # field.upload_to must change to our path, also '/media/' must remove from path otherwise raise error
+        if upload_to:
+            if callable(upload_to):    # if upload_to is function
+                getattr(instance, att_name).field.upload_to = upload_to
+            else:                      # if is string
+                getattr(instance, att_name).field.upload_to = upload_to.replace('/media/', '', 1)
+
+    def _save_format(self, buffer, full_name, format, instance, att_name, upload_to):
+        # writes other formats of a size (main format is saved by _save), returns name in storage
+        if instance:
+            content_type, size = PilImage.MIME.get(format), buffer.getbuffer().nbytes
+            field = instance._meta.get_field(att_name)
+            name = field.generate_filename(instance, full_name)
+            with measure(self.metrics, self, 'write', bytes=size, count=1):
+                return field.storage.save(name, InMemoryUploadedFile(buffer, att_name, full_name, content_type, size, None))
+        self.writer.add(upload_to + full_name, buffer)
+        return upload_to + full_name
+
+    def _save_outputs(self, height, outputs, instance, att_name, upload_to):
+        # outputs is like: [('WEBP', buffer), ('JPEG', buffer)], returns (height, full_name, upload_image, formats)
+        # formats of other formats are like: {'JPEG': name}, upload_image is None when there is no instance
+        (format, buffer), others = outputs[0], outputs[1:]
+        full_name = f'{self.name}-{height}' + f'.{format}'
+        upload_image = self._save(buffer, full_name, format, instance, att_name, upload_to=upload_to)
+        formats = {format: self._save_format(buffer, f'{self.name}-{height}.{format}', format, instance, att_name, upload_to)
+                   for format, buffer in others}
+        if instance:
+            instance.formats = formats
+        return height, full_name, upload_image, formats
+
+    def _render_chain(self, opened_image, chain, aspect_ratio, format, att_name, upload_to):
+        # resize + encode + write sizes of one chain (see plan_resizes), runs in thread pool when executor is 'thread'
+        # chain is like: [(0, '480', instance1), (2, '240', instance3)], returns [(index, (height, full_name, upload_image, formats))]
+        rets = []
+        for index, height, instance in chain:
+            options = output_options(self.output, height)
+            with measure(self.metrics, self, 'resize', size=height) as timer:
+                height, opened_image = resize(opened_image, height, aspect_ratio)
+                timer.set(pixels=opened_image.size[0] * opened_image.size[1])
+            with measure(self.metrics, self, 'encode', size=height) as timer:
+                outputs = encode_size(opened_image, format, options)
+                timer.set(bytes=sum(buffer.getbuffer().nbytes for format, buffer in outputs), count=len(outputs))
+            rets.append((index, self._save_outputs(height, outputs, instance, att_name, upload_to)))
+        return rets
+
+    def _render_all(self, opened_image, aspect_ratio, instances, format, att_name, upload_to):
+        # returns [(height, full_name, upload_image, formats), ...] in order of self.sizes
+        iter_instances = itertools.cycle(instances) if instances else None
+        jobs = [(index, size, next(iter_instances) if iter_instances else None) for index, size in enumerate(self.sizes)]
+        chains = [[jobs[index] for index in chain] for chain in plan_resizes(self.sizes, self.cascade_factor)]
+        with measure(self.metrics, self, 'decode') as timer:
+            source = prepare_source(opened_image, self.sizes, aspect_ratio, self.cascade_factor)
+            source.load()       # decode once here, otherwise every worker (thread/process) decodes the lazy image itself
+            timer.set(pixels=source.size[0] * source.size[1])
+        executor = get_executor(self.executor, self.max_workers)
+        rets = {}
+        if executor is None:
+            for chain in chains:
+                rets.update(self._render_chain(source, chain, aspect_ratio, format, att_name, upload_to))
+        elif isinstance(executor, ProcessPoolExecutor):   # only resize+encode in processes, writing stays here
+            futures = [executor.submit(resize_encode, source, [(index, size, output_options(self.output, size)) for index, size, _ in chain],
+                                       aspect_ratio, format) for chain in chains]
+            for future in futures:
+                for index, height, outputs, timings in future.result():
+                    if self.metrics:
+                        emit(self, 'resize', timings['resize'], size=height, pixels=timings['pixels'])
+                        emit(self, 'encode', timings['encode'], size=height, bytes=sum(len(content) for format, content in outputs), count=len(outputs))
+                    outputs = [(format, io.BytesIO(content)) for format, content in outputs]
+                    rets[index] = self._save_outputs(height, outputs, jobs[index][2], att_name, upload_to)
+        else:
+            futures = [executor.submit(self._render_chain, source, chain, aspect_ratio, format, att_name, upload_to)
+                       for chain in chains]
+            for future in futures:
+                rets.update(future.result())
+        return [rets[index] for index in range(len(self.sizes))]
 
     def build(self, model, att_name='image', opened_image=None, upload_to=None):
         instances = [model(alt=f'{self.alt}-{size}', **self.data) for size in self.sizes]
@@ -86,10 +551,29 @@ class ImageCreationSizes:
         return self.save(opened_image=opened_image, upload_to=upload_to, instances=instances, att_name=att_name)
 
     def upload(self, upload_to, opened_image=None):
-        # upload icons without using any models. returned value is simple python objects. each obj has 4 attr. like:
-        # image=<SimpleUploadedFile image.jpg>, url=/media/../qwer43asd2e4-720.JPG, alt=, size=720
+        # upload icons without using any models. returned value is simple python objects. each obj has attrs like:
+        # image=<LazyUploadedFile image.jpg>, url=/media/../qwer43asd2e4-720.JPG, alt=, size=720, name=../qwer43asd2e4-720.JPG
         return self.save(opened_image=opened_image, upload_to=upload_to)
 
+    @classmethod
+    def batch(cls, items, sizes, upload_to, max_workers=None, **kwargs):
+        # uploads several images in parallel (thread pool), items is list of data like: [{'image': .., 'alt': ..}, ...]
+        # returns per item (upload objects, None) or (None, exception), in order of items. kwargs pass to __init__
+        kwargs['executor'] = False     # each image is resized in one worker, workers mustn't wait for each other
+        max_workers = max_workers if max_workers else getattr(settings, 'IMAGES_EXECUTOR_WORKERS', None)
+
+        def upload(data):
+            try:
+                if not isinstance(data, dict) or not data.get('image'):
+                    raise InvalidImage('no image was submitted')
+                objects = cls(data=data, sizes=sizes, **kwargs).upload(upload_to=upload_to)
+                if not objects:     # .save() returns nothing when the image can't be read
+                    raise InvalidImage('image can not be read')
+                return objects, None
+            except Exception as e:
+                return None, e
+        return list(get_executor('thread', max_workers).map(upload, items))
+
     def save(self, opened_image=None, upload_to=None, instances=None, att_name='image'):
         '''
         - opened_image can be binary (multipart form-data) or base64.
@@ -103,54 +587,148 @@ class ImageCreationSizes:
         if not upload_to and not instances:  # specify 'upload_to' or take from instances (django's image field)
             raise ValueError("'instances' and 'upload_to' can't be None at the same time")
 
-        class Upload:
-            def __init__(self, image, url, alt, size, **kwargs):
-                kwargs['image'], kwargs['url'], kwargs['alt'], kwargs['size'] = image, url, alt, size
-                [setattr(self, key, kwargs[key]) for key in kwargs]
-
-            def __repr__(self):
-                return '<Upload object {} - (.image .url .alt .size)>'.format(self.alt)  # self.alt contain size too
-
         if not instances:
             instances = []
 
-        try:         # binary file (multipart form-data)
-            stream = io.BytesIO(self.data['image'].read())
-        except:      # base64 file
-            try:
-                import base64
-                stream = io.BytesIO(base64.b64decode(self.data['image'].split(';base64,')[1]))
-            except:       # when no image provided (like when update 'alt' field only)
-                return instances
-        opened_image = PilImage.open(stream) if not opened_image else opened_image
+        self.metrics = metrics_enabled()
+        try:         # binary file (multipart form-data) or base64 str
+            with measure(self.metrics, self, 'read') as timer:
+                stream = open_stream(self.data['image'], self.max_bytes)
+                if self.metrics:
+                    stream.seek(0, io.SEEK_END)
+                    timer.set(bytes=stream.tell())
+                    stream.seek(0)
+        except ImageTooLarge:
+            raise
+        except:       # when no image provided (like when update 'alt' field only)
+            return instances
+        try:
+            with measure(self.metrics, self, 'save', count=len(self.sizes)) as timer:
+                decoded = self._decode(stream, opened_image)
+                self.source_size = decoded.size
+                # passed opened_image can differ from data, except decoded images of the data (like decode_image(data['image']))
+                index = get_index(self.dedup, shared=bool(instances)) if opened_image is None or decoded.stream is stream else None
+                if index:
+                    reused = self._reuse(index, stream, upload_to, instances, att_name)
+                    if reused is not None:
+                        timer.set(dedup_hit=True)
+                        return reused
+                rets = self._save_stream(decoded, upload_to, instances, att_name)
+                if index and not instances:   # files of models are written in model saving, there .register() is called
+                    names = [obj.name for obj in rets] + [other.name for obj in rets for other in obj.formats.values()]
+                    stored = index.add(self.dedup_key, names)
+                    if stored != names:       # same image uploaded meanwhile (another process), its files are used
+                        self._drop(self.storage, names, stored)
+                        rets = self._fill(stored, instances, att_name)
+                return rets
+        finally:     # temp file of decoded base64 is created here (also when opened_image is passed), uploaded files aren't ours to close
+            if isinstance(self.data['image'], str):
+                stream.close()
 
+    def _decode(self, stream, opened_image):
+        # DecodedImage of opened_image, or of data['image'] (cached on file objects, see decode_image)
+        if isinstance(opened_image, DecodedImage):
+            check_pixels(opened_image, self.max_pixels)
+            return opened_image
+        if isinstance(opened_image, (PilImage.Image, io.BufferedReader)):    # io.BufferedReader: opened by built-in open()
+            return DecodedImage(opened_image, self.max_pixels)
+        if opened_image is None:
+            return decode_image(self.data['image'], stream, self.max_pixels)
+        raise Exception('opened_image is not object of PilImage, DecodedImage or python built in .open()')
+
+    def _reuse(self, index, stream, upload_to, instances, att_name):
+        # returns instances/upload objects filled by already generated files of the same image, or None if not found.
+        # names of index are names of main format of sizes (in order of self.sizes), followed by names of other formats
+        upload_to_key = f'{upload_to.__module__}.{upload_to.__qualname__}' if callable(upload_to) else upload_to
+        model = instances[0]._meta.label if instances else None
+        self.dedup_key = hash_key(stream, self.sizes, self.cascade_factor, self.output, upload_to_key, model, att_name)
+        names = index.get(self.dedup_key)
+        if not names or len(names) < len(self.sizes):
+            return None
+        storage = instances[0]._meta.get_field(att_name).storage if instances else self.storage
+        main, formats = self._split_names(names)
+        if not all(storage.exists(name) for name in [*main, *[name for others in formats for name in others.values()]]):
+            index.discard(self.dedup_key)    # deleted outside
+            return None
+        if not index.acquire(self.dedup_key):     # released (its files deleted) after .get()
+            return None
+        self.dedup_hit = True
+        return self._fill(names, instances, att_name)
+
+    def _split_names(self, names):
+        # names of index to names of main format of sizes and their other formats like:
+        # [{'JPEG': 'ImageSizes/2024/5/13/qwer43asd2e4-120.JPEG'}, ...]
+        names = names[:len(self.sizes)]
+        formats = []
+        for size, name in zip(self.sizes, names):
+            stem, main = name.rsplit('.', 1)
+            others = [other.upper() for other in output_options(self.output, size).get('formats', [])]
+            formats.append({other: f'{stem}.{other}' for other in others if other != main and check_format(other)})
+        return names, formats
+
+    def _fill(self, names, instances, att_name):
+        # returns instances/upload objects filled by files of names of index
+        names, formats = self._split_names(names)
+        if instances:        # names are like: 'ImageSizes/2024/5/13/qwer43asd2e4-120.JPEG'
+            for instance, name, others in zip(instances, names, formats):
+                setattr(instance, att_name, name)
+                instance.formats = others
+            return instances
+        rets = []            # names are names in self.storage like: 'posts_images/1402/3/20/qwer43asd2e4-720.JPG'
+        for size, name, others in zip(self.sizes, names, formats):
+            height = int(size) if size.isdigit() else size
+            others = {other: self._upload(other_name, height) for other, other_name in others.items()}
+            rets.append(self._upload(name, height, formats=others))
+        return rets
+
+    @staticmethod
+    def _drop(storage, names, stored):
+        # deletes our files of an image that was registered in index by another upload first
+        for name in names:
+            if name not in stored:
+                storage.delete(name)
+
+    def register(self, instances, att_name='image'):
+        # for build/update with dedup, files of instances are written when instances are saved, so after saving them
+        # this registers their names in dedup index (nothing to do when sizes were reused from index).
+        # returns True when the same image was registered meanwhile (another process), then instances are filled by
+        # its files and their own files are deleted, caller should save instances again
+        index = get_index(self.dedup, shared=True)
+        if index and self.dedup_key and not self.dedup_hit:
+            names = [getattr(instance, att_name).name for instance in instances]
+            names += [name for instance in instances for name in getattr(instance, 'formats', {}).values()]
+            stored = index.add(self.dedup_key, names)
+            if stored != names:
+                self._drop(instances[0]._meta.get_field(att_name).storage, names, stored)
+                self._fill(stored, instances, att_name)
+                self.dedup_hit = True
+                return True
+        return False
+
+    def _upload(self, name, height, saved=None, **kwargs):
+        # Upload object of a file written to self.storage, saved is {name: (saved name, size)} returned by writer.flush()
+        name, size = saved[name] if saved else (name, None)
+        content_type = PilImage.MIME.get(name.rsplit('.', 1)[-1].upper())
+        # url is like: /media/posts_images/1402/3/20/qwer43asd2e4-720.JPG
+        return Upload(image=LazyUploadedFile(self.storage, name, content_type, size), url=self.storage.url(name),
+                      alt=f'{self.alt}-{height}', size=height, name=name, **kwargs)
+
+    def _save_stream(self, decoded, upload_to, instances, att_name):
         if not callable(upload_to) and upload_to:  # upload_to is str
             if upload_to[-1] == '/':
                 upload_to = upload_to[:-1]
-            upload_to = self.get_path(upload_to)
-            if not os.path.exists(self.base_path + upload_to):
-                os.makedirs(self.base_path + upload_to)
+            upload_to = self.get_path(upload_to).replace('/media/', '', 1)    # name in storage like: posts_images/1402/3/20/
 
-        iter_instances, objects = itertools.cycle(instances) if instances else None, []
-        if isinstance(opened_image, PilImage.Image):
-            format = opened_image.format              # opened_image.format is like: "JPG"
-            height, width = opened_image.size                 # opened_image.size is like: (1080, 1920)
-            aspect_ratio = height / width
-            for height in self.sizes:
-                if height.isdigit():
-                    height = int(height)
-                    resized = opened_image.resize((height, int(height / aspect_ratio)))
-                else:
-                    resized = opened_image  # for 'default' size
-                full_name = f'{self.name}-{height}' + f'.{format}'
-                instance = next(iter_instances) if iter_instances else None
-                upload_image = self._save(resized, full_name, format, instance, att_name, upload_to=upload_to)
-                # url is like: /media/posts_images/1402/3/20/qwer43asd2e4-720.JPG
-                if not instances:
-                    objects += [Upload(image=upload_image, url=upload_to+full_name, alt=f'{self.alt}-{height}', size=height)]
-            return instances or objects
-
-        elif isinstance(opened_image, io.BufferedReader):      # open image by built-in function open()
-            pass
-        else:
-            raise Exception('opened_image is not object of PilImage or python built in .open()')
+        objects = []
+        format = decoded.format                   # decoded.format is like: "JPEG"
+        height, width = decoded.size              # decoded.size is like: (1080, 1920), after exif orientation
+        aspect_ratio = height / width
+        rets = self._render_all(decoded, aspect_ratio, instances, format, att_name, upload_to)
+        if not instances:
+            with measure(self.metrics, self, 'write') as timer:
+                saved = self.writer.flush()       # all files of the image are written here, concurrently
+                timer.set(bytes=sum(size for name, size in saved.values()), count=len(saved))
+            for height, full_name, upload_image, formats in rets:
+                formats = {format: self._upload(name, height, saved) for format, name in formats.items()}
+                objects.append(self._upload(upload_to + full_name, height, saved, formats=formats))
+        return instances or objects
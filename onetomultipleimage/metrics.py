@@ -0,0 +1,122 @@
+from django.conf import settings
+from django.dispatch import Signal
+from django.utils.module_loading import import_string
+
+import time
+import threading
+from collections import deque
+
+# sent after every stage of image processing with: stage, seconds, instance and (when known) bytes, pixels, size, count.
+# stages of ImageCreationSizes: 'read' (input to stream, like decoding base64), 'decode', 'resize', 'encode', 'write'
+# (storage writes of .upload() and other formats), 'save' (whole .save()). stages of FatherImage: 'write' (files of
+# ImageSizes), 'db' (bulk_create/bulk_update of ImageSizes)
+image_stage = Signal()
+
+_callbacks = {}
+
+
+def get_callback():
+    # settings.IMAGES_METRICS_CALLBACK is a function or its dotted path, called like image_stage receivers
+    callback = getattr(settings, 'IMAGES_METRICS_CALLBACK', None)
+    if isinstance(callback, str):
+        if callback not in _callbacks:
+            _callbacks[callback] = import_string(callback)
+        return _callbacks[callback]
+    return callback
+
+
+def enabled():
+    # checked once per save, when nothing listens stages aren't timed at all
+    return bool(get_callback()) or image_stage.has_listeners()
+
+
+def emit(instance, stage, seconds, **info):
+    image_stage.send(sender=type(instance), instance=instance, stage=stage, seconds=seconds, **info)
+    callback = get_callback()
+    if callback:
+        callback(sender=type(instance), instance=instance, stage=stage, seconds=seconds, **info)
+
+
+class Timer:
+    # with measure(...) as timer: ... timer.set(bytes=10)   emits the stage when the block ends without error
+    def __init__(self, instance, stage, info):
+        self.instance, self.stage, self.info = instance, stage, info
+
+    def set(self, **info):
+        self.info.update(info)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            emit(self.instance, self.stage, time.perf_counter() - self.start, **self.info)
+
+
+class NoTimer:
+    def set(self, **info):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        pass
+
+
+NO_TIMER = NoTimer()
+
+
+def measure(on, instance, stage, **info):
+    # on is result of enabled(), info like: size='120', pixels=14400
+    return Timer(instance, stage, info) if on else NO_TIMER
+
+
+class Aggregator:
+    # optional in-process aggregator of stages, like:
+    #   aggregator = Aggregator().connect()
+    #   aggregator.summary()   # {'encode': {'count': 12, 'seconds': 0.2, 'bytes': 81234, 'pixels': 0, 'p50': .., 'p90': .., 'p99': ..}}
+    # last `max_samples` durations of every stage are kept for percentiles, totals count all of them
+    def __init__(self, max_samples=10000):
+        self.max_samples = max_samples
+        self.lock = threading.Lock()
+        self.reset()
+
+    def __call__(self, stage, seconds, bytes=None, pixels=None, **kwargs):
+        with self.lock:
+            if stage not in self.samples:
+                self.samples[stage] = deque(maxlen=self.max_samples)
+                self.totals[stage] = {'count': 0, 'seconds': 0.0, 'bytes': 0, 'pixels': 0}
+            self.samples[stage].append(seconds)
+            totals = self.totals[stage]
+            totals['count'] += 1
+            totals['seconds'] += seconds
+            totals['bytes'] += bytes or 0
+            totals['pixels'] += pixels or 0
+
+    def connect(self):
+        image_stage.connect(self, weak=False, dispatch_uid=id(self))
+        return self
+
+    def disconnect(self):
+        image_stage.disconnect(dispatch_uid=id(self))
+
+    def reset(self):
+        with self.lock:
+            self.samples, self.totals = {}, {}
+
+    def percentile(self, stage, percent):
+        # nearest-rank percentile of durations (seconds) of the stage, None if stage has no samples
+        with self.lock:
+            samples = sorted(self.samples.get(stage, []))
+        if not samples:
+            return None
+        return samples[max(0, -(-len(samples) * percent // 100) - 1)]
+
+    def summary(self, percents=(50, 90, 99)):
+        with self.lock:
+            stages = {stage: dict(totals) for stage, totals in self.totals.items()}
+        for stage, totals in stages.items():
+            totals.update({f'p{percent}': self.percentile(stage, percent) for percent in percents})
+        return stages
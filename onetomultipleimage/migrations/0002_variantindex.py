@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('onetomultipleimage', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VariantIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True, verbose_name='key')),
+                ('names', models.JSONField(verbose_name='names')),
+                ('refcount', models.PositiveIntegerField(default=1, verbose_name='reference count')),
+            ],
+            options={
+                'verbose_name': 'Variant index',
+                'verbose_name_plural': 'Variant indexes',
+            },
+        ),
+        migrations.AddField(
+            model_name='fatherimage',
+            name='variants_key',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, verbose_name='variants key'),
+        ),
+    ]
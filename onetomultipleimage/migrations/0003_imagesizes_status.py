@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:34
+
+import onetomultipleimage.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('onetomultipleimage', '0002_variantindex'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagesizes',
+            name='status',
+            field=models.CharField(choices=[('pending', 'pending'), ('processing', 'processing'), ('ready', 'ready'), ('failed', 'failed')], db_index=True, default='ready', max_length=10, verbose_name='status'),
+        ),
+        migrations.AlterField(
+            model_name='imagesizes',
+            name='image',
+            field=models.ImageField(blank=True, upload_to=onetomultipleimage.models.image_path_selector, verbose_name='image'),
+        ),
+    ]
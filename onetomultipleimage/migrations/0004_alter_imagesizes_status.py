@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('onetomultipleimage', '0003_imagesizes_status'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='imagesizes',
+            name='status',
+            field=models.CharField(choices=[('pending', 'pending'), ('processing', 'processing'), ('ready', 'ready'), ('failed', 'failed'), ('lazy', 'lazy')], db_index=True, default='ready', max_length=10, verbose_name='status'),
+        ),
+    ]
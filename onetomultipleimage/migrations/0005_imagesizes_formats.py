@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('onetomultipleimage', '0004_alter_imagesizes_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagesizes',
+            name='formats',
+            field=models.JSONField(blank=True, default=dict, verbose_name='formats'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('onetomultipleimage', '0005_imagesizes_formats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fatherimage',
+            name='manifest',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='manifest'),
+        ),
+        migrations.AddIndex(
+            model_name='imagesizes',
+            index=models.Index(fields=['father', 'size'], name='onetomultip_father__ea6cb6_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('onetomultipleimage', '0006_fatherimage_manifest_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagesizes',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='claimed at'),
+        ),
+    ]
@@ -1,32 +1,47 @@
-from django.db import models
+from django.db import models, transaction, connection
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from django.conf import settings
+from django.urls import reverse, NoReverseMatch
 from django.utils.translation import gettext_lazy as _
 
-from datetime import datetime
+import time
+import uuid
+import contextlib
 
-from .methods import ImageCreationSizes
+from .methods import ImageCreationSizes, cached_decode, decode_image, size_dimensions
+from .dedup import get_index
+from .workers import get_worker
+from .lazy import invalidate_render_cache
+from .metrics import measure, enabled as metrics_enabled
 from .fields import ListCharField
+from . import paths
 
 
 def image_path_selector(instance, filename):
-    if getattr(settings, 'IMAGES_PATH_TYPE', None) == 'jalali':
-        try:
-            import jdatetime
-            date = jdatetime.datetime.fromgregorian(date=datetime.now()).strftime('%Y %-m %-d').split()
-        except ImportError:
-            raise ImportError("please install 'jdatetime' package")
-    else:
-        now = datetime.now()
-        date = f"{now.year} {now.month} {now.day}".split()
-    return f'{instance.__class__.__name__}/{date[0]}/{date[1]}/{date[2]}/{filename}'
+    # like: 'ImageSizes/1403/4/25/qwer43asd2e4-120.JPEG', see paths.py. originals (FatherImage) keep names of clients
+    # (like 'image.jpg'), their directory key is random instead, so 'hashed' naming spreads them too
+    key = None if isinstance(instance, ImageSizes) else uuid.uuid4().hex
+    return paths.resolve(instance.__class__.__name__, filename, key)
+
+
+class FatherImageQuerySet(models.QuerySet):
+    def with_variants(self):
+        # for reading variants of images from their manifest (see FatherImage.variants), without query to ImageSizes.
+        # 'sizes' isn't loaded, keys of manifest are the sizes
+        return self.defer('sizes')
 
 
 class FatherImage(models.Model):
     image = models.ImageField(_('image'), upload_to=image_path_selector)
     alt = models.CharField(_('alt'), max_length=55, unique=True, null=True)
     sizes = ListCharField(_('sizes'), max_length=255)  # input data like: ['120', '240', '480']
+    variants_key = models.CharField(_('variants key'), max_length=64, null=True, blank=True, editable=False)  # dedup
+    manifest = models.JSONField(_('manifest'), default=dict, blank=True, editable=False)   # see build_manifest
     # imagesizes, reverse relation
 
+    objects = FatherImageQuerySet.as_manager()
+
     class Meta:
         verbose_name = _('Image')
         verbose_name_plural = _('Images')
@@ -35,47 +50,289 @@ class FatherImage(models.Model):
         super().__init__(*args, **kwargs)
         self.pre_image = self.image
         self.pre_alt = self.alt
+        self.pre_sizes = list(self.__dict__.get('sizes') or [])     # 'sizes' is not loaded in .with_variants()
 
     def __str__(self):
         return f'{self.alt}'
 
-    def save(self, *args, **kwargs):
+    def save(self, *args, deferred=None, lazy=None, **kwargs):
+        # deferred=True stores the image and creates ImageSizes in 'pending' status, their files are generated in
+        # background by the worker (settings.IMAGES_WORKER). default is settings.IMAGES_DEFERRED
+        # lazy=True creates ImageSizes in 'lazy' status, their files are generated on first request of them (see views.py)
+        # default is settings.IMAGES_LAZY
+        deferred = deferred if deferred is not None else getattr(settings, 'IMAGES_DEFERRED', False)
+        lazy = lazy if lazy is not None else getattr(settings, 'IMAGES_LAZY', False)
+        status = ImageSizes.LAZY if lazy else ImageSizes.PENDING if deferred else None
         alt = self.alt    # self.alt is None for default
         change = True if self.id else False
         if not change:      # FatherImage creation
             self.alt = ImageCreationSizes.add_size_to_alt('default', alt)
         elif alt != self.pre_alt:         # FatherImage updating, prevent alt overriding like: 'asd32a-default-default'
             self.alt = ImageCreationSizes.add_size_to_alt('default', alt)
+        decoded = cached_decode(self.image) if not self.image._committed else None
         super().save(*args, **kwargs)
+        if decoded is not None:     # saving replaces the uploaded file by the stored one, its decoded image is reused
+            decoded.rebind(self.image)
+            self.image.decoded_image = decoded
         if not change:     # ImageSizes creation
-            img = ImageCreationSizes(data={'image': self.image, 'alt': alt}, sizes=self.sizes)
+            img, instances = self.create_sizes(self.sizes, alt, status)
+            if not status:
+                self.set_variants_key(img, instances)
+            elif status == ImageSizes.PENDING:     # before manifest, rows are queued even if it fails
+                self.enqueue()
+            self.sync_manifest(instances, img.source_size)
+        else:         # ImageSizes updating
+            self.update_sizes(alt if alt != self.pre_alt else None, status)
+        self.pre_image, self.pre_alt, self.pre_sizes = self.image, self.alt, list(self.sizes)
+
+    def create_sizes(self, sizes, alt=None, status=None, dedup=None):
+        # creates ImageSizes of sizes, their files are generated now (status None) or later ('pending' or 'lazy')
+        img = ImageCreationSizes(data={'image': self.image, 'alt': alt}, sizes=sizes, dedup=dedup)
+        if status:
+            instances = [ImageSizes(alt=f'{img.alt}-{size}', size=size, father=self, status=status) for size in sizes]
+        else:
             instances = img.build(model=ImageSizes, upload_to=ImageSizes._meta.get_field('image').upload_to)
-            for instance, size in zip(instances, self.sizes):
+            for instance, size in zip(instances, sizes):
                 instance.father, instance.size = self, size
+            self.write_files(instances)
+        with measure(metrics_enabled(), self, 'db', count=len(instances)):
             ImageSizes.objects.bulk_create(instances)
-        else:         # ImageSizes updating
-            data = {'alt': alt, 'image': self.image if self.image is not self.pre_image else None}
-            img = ImageCreationSizes(data=data, sizes=self.sizes)
-            instances = self.imagesizes.all()
-            instances = img.update(instances=instances, upload_to=ImageSizes._meta.get_field('image').upload_to)
-            if data.get('image'):
-                for instance in instances:
-                    image_data = instance.image.file
-                    instance.image.save(instance.image.name, image_data)   # image field isn't saved with bulk_update
-            for instance, size in zip(instances, self.sizes):
-                instance.size, instance.father_id = size, self.id
-            ImageSizes.objects.bulk_update(instances, [*list(data.keys()), *['size', 'father_id']])
+        return img, instances
+
+    def update_sizes(self, alt=None, status=None):
+        # diffs self.sizes with saved ImageSizes: added sizes are created, removed ones are deleted (with their files)
+        # and unchanged ones are left alone. files are generated again only when image is changed.
+        # alt is new alt of FatherImage (None if alt is not changed)
+        image_changed = self.image is not self.pre_image
+        saved = {instance.size: instance for instance in self.imagesizes.all()}
+        removed = [instance for size, instance in saved.items() if size not in self.sizes]
+        kept = [saved[size] for size in self.sizes if size in saved]
+        added = [size for size in self.sizes if size not in saved]
+        base_alt = alt if alt else self.alt.rsplit('-default', 1)[0]    # self.alt is like: 'sea_food-default'
+        if removed:
+            self.delete_sizes(removed)
+        if alt:
+            for instance in kept:
+                instance.alt = f'{alt}-{instance.size}'
+        if image_changed:
+            invalidate_render_cache(self.pk, [instance.size for instance in kept])
+
+        if image_changed and not status:      # generate files of all sizes again, at once
+            new = [ImageSizes(alt=f'{base_alt}-{size}', size=size, father=self) for size in added]
+            by_size = {instance.size: instance for instance in [*kept, *new]}
+            instances = [by_size[size] for size in self.sizes]
+            img = ImageCreationSizes(data={'image': self.image, 'alt': None}, sizes=self.sizes)
+            img.update(instances=instances, upload_to=ImageSizes._meta.get_field('image').upload_to)
+            self.write_files(instances)
+            for instance in kept:
+                instance.status = ImageSizes.READY
+            with measure(metrics_enabled(), self, 'db', count=len(instances)):
+                ImageSizes.objects.bulk_update(kept, ['alt', 'image', 'status', 'formats'])
+                ImageSizes.objects.bulk_create(new)
+            self.set_variants_key(img, instances)
+            self.sync_manifest(instances, img.source_size)
+            return
+
+        if image_changed:      # files are generated by worker or on first request
+            for instance in kept:
+                instance.status = status
+        if alt or image_changed:
+            with measure(metrics_enabled(), self, 'db', count=len(kept)):
+                ImageSizes.objects.bulk_update(kept, ['alt', 'status'])
+        if added:              # generated from stored image (or later), dedup works only for all sizes together
+            self.create_sizes(added, base_alt, status, dedup=False)
+        if status == ImageSizes.PENDING and (image_changed or added):
+            self.enqueue()
+        if removed or added or alt or image_changed:
+            self.sync_manifest()
+
+    def delete_sizes(self, instances):
+        # deletes ImageSizes and their files. files may be shared by dedup index (variants_key), those are deleted when
+        # the index releases them (FatherImage deleting or its image changing)
+        invalidate_render_cache(self.pk, [instance.size for instance in instances])
+        ImageSizes.objects.filter(pk__in=[instance.pk for instance in instances]).delete()
+        if not self.variants_key:
+            storage = ImageSizes._meta.get_field('image').storage
+            for instance in instances:
+                for name in [instance.image.name, *instance.formats.values()]:
+                    if name:
+                        storage.delete(name)
+
+    def write_files(self, instances):
+        # writes generated files of ImageSizes to storage of their image field (before their rows are saved)
+        with measure(metrics_enabled(), self, 'write') as timer:
+            written = []
+            for instance in instances:
+                if not instance.image._committed:     # not reused from dedup index
+                    written.append(instance.image.file.size)
+                    instance.image.save(instance.image.name, instance.image.file, save=False)
+            timer.set(bytes=sum(written), count=len(written))
+
+    def enqueue(self):
+        # sends pending ImageSizes to the worker after current transaction is committed (worker must see the rows)
+        transaction.on_commit(lambda: get_worker().enqueue(self.pk))
+
+    def render_pending(self, instances=None):
+        # generates files of ImageSizes claimed by a worker or lazy view (status 'processing'), see workers.py, lazy.py
+        instances = list(instances) if instances is not None else list(self.imagesizes.filter(status=ImageSizes.PROCESSING))
+        if not instances:
+            return []
+        partial = len(instances) != len(self.sizes)    # like lazy mode, dedup works only for all sizes together
+        img = ImageCreationSizes(data={'image': self.image, 'alt': None}, sizes=[instance.size for instance in instances],
+                                 dedup=False if partial else None)
+        instances = img.update(instances=instances, upload_to=ImageSizes._meta.get_field('image').upload_to)
+        self.write_files(instances)
+        for instance in instances:
+            instance.status = ImageSizes.READY
+        with measure(metrics_enabled(), self, 'db', count=len(instances)):
+            ImageSizes.objects.bulk_update(instances, ['image', 'status', 'formats'])
+        if not partial:
+            self.set_variants_key(img, instances)
+        self.sync_manifest(None if partial else instances, img.source_size)
+        return instances
+
+    def build_manifest(self, instances, source_size=None):
+        # variants of the image like: {'120': {'url': .., 'width': 120, 'height': 90, 'format': 'JPEG', 'alt': ..,
+        # 'status': 'ready', 'formats': {'WEBP': url}}, ...}. source_size is (width, height) of self.image after exif
+        # orientation, read from image header when not passed (self.image.width/height are before orientation)
+        if not source_size:
+            try:
+                source_size = decode_image(self.image).size     # only header is read, decoding is left to renders
+            except (OSError, ValueError):      # broken or missing image
+                source_size = (None, None)
+        manifest = {}
+        for instance in instances:
+            width, height = size_dimensions(instance.size, source_size) if all(source_size) else (None, None)
+            ready = instance.status == ImageSizes.READY
+            manifest[instance.size] = {'url': instance.url, 'width': width, 'height': height, 'alt': instance.alt,
+                                       'format': instance.image.name.rsplit('.', 1)[-1].upper() if ready else None,
+                                       'status': instance.status, 'formats': instance.format_urls}
+        return manifest
+
+    def sync_manifest(self, instances=None, source_size=None):
+        # saves manifest of ImageSizes of the image (all of them, read from db when instances isn't passed)
+        # renders of other sizes of this image (worker, lazy view) wait for the lock, so none of them is lost. sqlite has
+        # no row locks (and its read to write lock upgrade fails in concurrent transactions), there no transaction is used
+        locking = instances is None and connection.features.has_select_for_update
+        with transaction.atomic() if locking else contextlib.nullcontext():
+            if locking:
+                list(FatherImage.objects.select_for_update().filter(pk=self.pk).values_list('pk', flat=True))
+            if instances is None:
+                instances = self.imagesizes.all()
+            self.manifest = self.build_manifest(instances, source_size)
+            FatherImage.objects.filter(pk=self.pk).update(manifest=self.manifest)
+
+    @property
+    def variants(self):
+        # manifest as list like: [{'size': '120', 'url': .., 'width': 120, ...}, ...] sorted by width. images saved before
+        # manifest existed get their manifest here once (saved for next reads)
+        if not self.manifest and self.pk:
+            self.sync_manifest()
+        return sorted(({'size': size, **variant} for size, variant in self.manifest.items()), key=lambda variant: variant['width'] or 0)
+
+    def best_variant(self, width):
+        # smallest variant at least `width` pixels wide (the biggest one if none is), None when there is no variant
+        variants = self.variants
+        for variant in variants:
+            if (variant['width'] or 0) >= width:
+                return variant
+        return variants[-1] if variants else None
+
+    @property
+    def sizes_status(self):
+        # 'ready' when files of all sizes are generated (or are generated on request in lazy mode), 'failed' if any of
+        # them failed, otherwise 'pending'
+        statuses = set(self.imagesizes.values_list('status', flat=True))
+        if ImageSizes.FAILED in statuses:
+            return ImageSizes.FAILED
+        return ImageSizes.READY if statuses <= {ImageSizes.READY, ImageSizes.LAZY} else ImageSizes.PENDING
+
+    def is_ready(self):
+        return self.sizes_status == ImageSizes.READY
+
+    def wait(self, timeout=None, interval=0.1):
+        # blocks until sizes are generated (or failed), returns False when timeout (seconds) is reached
+        start = time.monotonic()
+        while self.sizes_status == ImageSizes.PENDING:
+            if timeout is not None and time.monotonic() - start >= timeout:
+                return False
+            time.sleep(interval)
+        return True
+
+    def set_variants_key(self, img, instances):
+        # registers generated sizes in dedup index and releases previous ones (their files are deleted if not shared)
+        if img.register(instances):      # same image was saved meanwhile by another process, its files are used
+            ImageSizes.objects.bulk_update(instances, ['image', 'formats'])
+        if img.dedup_key != self.variants_key:
+            release_variants(self.variants_key)
+            self.variants_key = img.dedup_key
+            FatherImage.objects.filter(pk=self.pk).update(variants_key=img.dedup_key)
 
 
 class ImageSizes(models.Model):
-    image = models.ImageField(_('image'), upload_to=image_path_selector)
+    PENDING, PROCESSING, READY, FAILED, LAZY = 'pending', 'processing', 'ready', 'failed', 'lazy'
+    STATUS_CHOICES = [(PENDING, _('pending')), (PROCESSING, _('processing')), (READY, _('ready')), (FAILED, _('failed')),
+                      (LAZY, _('lazy'))]
+
+    image = models.ImageField(_('image'), upload_to=image_path_selector, blank=True)   # blank until status is 'ready'
     alt = models.CharField(_('alt'), max_length=55, unique=True, null=True)
     size = models.CharField(_('size'), max_length=20)
     father = models.ForeignKey(FatherImage, related_name='imagesizes', on_delete=models.CASCADE, verbose_name=_('image'))
+    status = models.CharField(_('status'), max_length=10, choices=STATUS_CHOICES, default=READY, db_index=True)
+    formats = models.JSONField(_('formats'), default=dict, blank=True)  # other formats like: {'JPEG': 'ImageSizes/../a-120.JPEG'}
+    claimed_at = models.DateTimeField(_('claimed at'), null=True, blank=True, editable=False)  # when status became 'processing'
 
     class Meta:
         verbose_name = _('Image size')
         verbose_name_plural = _('Images sizes')
+        indexes = [models.Index(fields=['father', 'size'])]
 
     def __str__(self):
         return f'{self.alt}'
+
+    @property
+    def url(self):
+        # url of not generated sizes (lazy/pending) is url of the view generates them on first request (see urls.py),
+        # None when onetomultipleimage.urls isn't included in project's urls
+        if self.status == self.READY:
+            return self.image.url
+        try:
+            return reverse('onetomultipleimage:image_size', kwargs={'father_id': self.father_id, 'size': self.size})
+        except NoReverseMatch:
+            return None
+
+    @property
+    def format_urls(self):
+        # urls of other formats of the image (IMAGES_OUTPUT['formats']) like: {'JPEG': '/media/ImageSizes/../a-120.JPEG'}
+        storage = self._meta.get_field('image').storage
+        return {format: storage.url(name) for format, name in self.formats.items()}
+
+
+class VariantIndex(models.Model):
+    # index of generated sizes by hash of source image, used by dedup.DatabaseIndex
+    key = models.CharField(_('key'), max_length=64, unique=True)
+    names = models.JSONField(_('names'))   # like: ['ImageSizes/2024/5/13/qwer43asd2e4-120.JPEG', ...]
+    refcount = models.PositiveIntegerField(_('reference count'), default=1)
+
+    class Meta:
+        verbose_name = _('Variant index')
+        verbose_name_plural = _('Variant indexes')
+
+    def __str__(self):
+        return f'{self.key}'
+
+
+def release_variants(key):
+    # deletes files of sizes when no other FatherImage uses them
+    index = get_index(shared=True)
+    if key and index:
+        storage = ImageSizes._meta.get_field('image').storage
+        for name in index.release(key):
+            storage.delete(name)
+
+
+@receiver(post_delete, sender=FatherImage)
+def father_image_deleted(sender, instance, **kwargs):
+    # 'sizes' is not loaded in .with_variants(), keys of manifest are the sizes there
+    invalidate_render_cache(instance.pk, instance.__dict__.get('sizes') or list(instance.manifest))
+    release_variants(instance.variants_key)
@@ -0,0 +1,67 @@
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+import hashlib
+import threading
+from datetime import date
+
+_dates = {}             # like: {('jalali', date(2024, 7, 15)): '1403/4/25'}, only today is kept
+_lock = threading.Lock()
+
+
+def date_dir(calendar=None):
+    # directory of today like: '2024/7/15' (or '1403/4/25' in jalali), computed once a day instead of for every file.
+    # calendar is 'jalali' or 'gregorian', default is settings.IMAGES_PATH_TYPE
+    calendar = calendar if calendar else getattr(settings, 'IMAGES_PATH_TYPE', None)
+    key = (calendar, date.today())
+    path = _dates.get(key)
+    if path is None:
+        if calendar == 'jalali':
+            try:
+                import jdatetime
+            except ImportError:
+                raise ImportError("please install 'jdatetime' package")
+            today = jdatetime.date.fromgregorian(date=key[1])
+        else:
+            today = key[1]
+        path = f'{today.year}/{today.month}/{today.day}'     # %Y %-m %-d format doesn't work in windows
+        with _lock:
+            if any(cached[1] != key[1] for cached in _dates):    # new day
+                _dates.clear()
+            _dates[key] = path
+    return path
+
+
+def date_scheme(prefix, key):
+    # like: 'posts_images/1403/4/25/'
+    return f'{prefix}/{date_dir()}/'
+
+
+def hashed_scheme(prefix, key):
+    # like: 'posts_images/1403/4/25/7f/', files of a busy day are spread in 256 directories by hash of key
+    return f'{prefix}/{date_dir()}/{hashlib.sha1(key.encode()).hexdigest()[:2]}/'
+
+
+SCHEMES = {'date': date_scheme, 'hashed': hashed_scheme}
+
+
+def get_scheme(scheme=None):
+    # scheme is 'date', 'hashed', function like: scheme(prefix, key) -> directory or its dotted path.
+    # default is settings.IMAGES_NAMING ('date')
+    scheme = scheme if scheme else getattr(settings, 'IMAGES_NAMING', 'date')
+    if isinstance(scheme, str):
+        if scheme not in SCHEMES:
+            SCHEMES[scheme] = import_string(scheme)
+        return SCHEMES[scheme]
+    return scheme
+
+
+def directory(prefix, key=''):
+    # directory of files of an image, key is same for all sizes of an image (like its uuid name), so they stay together
+    return get_scheme()(prefix.rstrip('/'), key)
+
+
+def resolve(prefix, filename, key=None):
+    # name of file like: 'ImageSizes/1403/4/25/qwer43asd2e4-120.JPEG', key of 'qwer43asd2e4-120.JPEG' is 'qwer43asd2e4'
+    # (default key). pass key for files not named by us (like 'image.jpg' of clients), so they don't share a directory
+    return directory(prefix, key if key else filename.rsplit('.', 1)[0].rsplit('-', 1)[0]) + filename
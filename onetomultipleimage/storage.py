@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, storages
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+_pools = {}
+_storages = {}
+_lock = threading.Lock()
+
+
+def get_storage(storage=None):
+    # storage used by ImageCreationSizes.upload(). storage is Storage object, alias of settings.STORAGES or None
+    # (default is settings.IMAGES_STORAGE). without any, files are saved in <BASE_DIR>/media/ like previous versions
+    storage = storage if storage is not None else getattr(settings, 'IMAGES_STORAGE', None)
+    if isinstance(storage, str):
+        return storages[storage]
+    if storage is None:
+        location = os.path.join(str(settings.BASE_DIR), 'media')
+        with _lock:
+            if location not in _storages:
+                _storages[location] = FileSystemStorage(location=location, base_url='/media/')
+            return _storages[location]
+    return storage
+
+
+def get_pool(max_workers=None):
+    # separate from pools of methods.get_executor, writes are submitted from inside of those pools
+    max_workers = max_workers if max_workers else getattr(settings, 'IMAGES_STORAGE_WORKERS', None)
+    with _lock:
+        if max_workers not in _pools:
+            _pools[max_workers] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='onetomultipleimage-storage')
+        return _pools[max_workers]
+
+
+class BatchWriter:
+    # collects files of all sizes of one image (from any thread) and writes them together by .flush(). writes run
+    # concurrently, remote storages spend most of the time of a write waiting for network
+    def __init__(self, storage):
+        self.storage = storage
+        self.files = []     # like: [(name, buffer), ...]
+        self.lock = threading.Lock()
+
+    def add(self, name, content):
+        with self.lock:
+            self.files.append((name, content))
+
+    def flush(self):
+        # returns {name: (saved name, size)}, storage can change names (like when a file with that name exists)
+        with self.lock:
+            files, self.files = self.files, []
+        if len(files) > 1:
+            saved = list(get_pool().map(lambda file: self.storage.save(*file), files))
+        else:
+            saved = [self.storage.save(name, content) for name, content in files]
+        return {name: (saved_name, content.getbuffer().nbytes) for (name, content), saved_name in zip(files, saved)}
@@ -0,0 +1,8 @@
+from django.urls import path
+
+from . import views
+
+app_name = 'onetomultipleimage'
+urlpatterns = [
+    path('<int:father_id>/<str:size>/', views.image_size, name='image_size'),
+]
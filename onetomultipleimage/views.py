@@ -0,0 +1,17 @@
+from django.http import FileResponse, Http404
+
+from .lazy import get_size, invalidate_render_cache
+from .models import ImageSizes
+
+
+def image_size(request, father_id, size):
+    # serves a size of FatherImage, file of the size is generated on its first request (lazy mode) then served from disk
+    try:
+        name = get_size(father_id, size)
+    except ImageSizes.DoesNotExist:
+        raise Http404('image size not found')
+    try:
+        return FileResponse(ImageSizes._meta.get_field('image').storage.open(name, 'rb'))
+    except FileNotFoundError:      # file deleted meanwhile (like deleting its FatherImage), cached name is stale
+        invalidate_render_cache(father_id, [size])
+        raise Http404('image size not found')
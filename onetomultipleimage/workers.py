@@ -0,0 +1,116 @@
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+import time
+import queue
+import logging
+import threading
+from datetime import timedelta
+
+logger = logging.getLogger(__name__)
+
+
+def process(father_id):
+    # claims pending ImageSizes of a FatherImage and generates their files. returns False if nothing was pending
+    # (claimed by another worker already). claiming is one UPDATE, so several workers can poll the same table.
+    # only rows claimed here are rendered (claimed_at is the claim token), others may be claimed by the lazy view
+    from .models import FatherImage, ImageSizes
+    pending = list(ImageSizes.objects.filter(father_id=father_id, status=ImageSizes.PENDING).values_list('pk', flat=True))
+    token = timezone.now()
+    if not pending or not ImageSizes.objects.filter(pk__in=pending, status=ImageSizes.PENDING).update(
+            status=ImageSizes.PROCESSING, claimed_at=token):
+        return False
+    claimed = ImageSizes.objects.filter(pk__in=pending, status=ImageSizes.PROCESSING, claimed_at=token)
+    try:
+        FatherImage.objects.get(pk=father_id).render_pending(list(claimed))
+    except Exception:
+        logger.exception('generating sizes of FatherImage %s failed', father_id)
+        claimed.update(status=ImageSizes.FAILED)
+    return True
+
+
+def reclaim_stale(**filters):
+    # puts ImageSizes claimed by a killed worker (deploy, OOM, ...) back to 'pending', so they are generated again.
+    # claims older than settings.IMAGES_WORKER_TIMEOUT seconds (default 600) are stale. returns number of them
+    from .models import ImageSizes
+    stale = timezone.now() - timedelta(seconds=getattr(settings, 'IMAGES_WORKER_TIMEOUT', 600))
+    return ImageSizes.objects.filter(Q(claimed_at__lt=stale) | Q(claimed_at__isnull=True), status=ImageSizes.PROCESSING,
+                                     **filters).update(status=ImageSizes.PENDING, claimed_at=None)
+
+
+class ThreadWorker:
+    # generates sizes in background threads of the same process. sizes of a killed process stay 'pending' (or stale
+    # 'processing') in db and can be generated by DatabaseWorker later
+    def __init__(self, threads=None):
+        self.threads_count = threads if threads else getattr(settings, 'IMAGES_WORKER_THREADS', 1)
+        self.queue = queue.Queue()
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def enqueue(self, father_id):
+        with self.lock:
+            if not self.threads:
+                for i in range(self.threads_count):
+                    thread = threading.Thread(target=self.run, name=f'onetomultipleimage-worker-{i}', daemon=True)
+                    thread.start()
+                    self.threads.append(thread)
+        self.queue.put(father_id)
+
+    def run(self):
+        while True:
+            father_id = self.queue.get()
+            try:
+                process(father_id)
+            except Exception:      # like db errors of claiming, the thread must keep serving next images
+                logger.exception('processing FatherImage %s failed', father_id)
+            finally:
+                close_old_connections()
+                self.queue.task_done()
+
+    def join(self):
+        # blocks until all enqueued images are processed
+        self.queue.join()
+
+
+class DatabaseWorker:
+    # pending ImageSizes rows are the queue, no broker is needed. enqueue does nothing, sizes are generated by
+    # `python manage.py process_images` (calls .run()) that polls the table
+    def enqueue(self, father_id):
+        pass
+
+    def run_once(self, limit=100):
+        # returns number of processed FatherImages
+        from .models import ImageSizes
+        reclaim_stale()
+        father_ids = ImageSizes.objects.filter(status=ImageSizes.PENDING).values_list('father_id', flat=True).distinct()[:limit]
+        return sum(process(father_id) for father_id in list(father_ids))
+
+    def run(self, interval=1, limit=100):
+        while True:
+            processed = self.run_once(limit)
+            close_old_connections()
+            if not processed:
+                time.sleep(interval)
+
+
+_workers = {}
+_workers_lock = threading.Lock()
+
+
+def get_worker(worker=None):
+    # worker is 'thread', 'db', dotted path of worker class or worker object (default is settings.IMAGES_WORKER)
+    worker = worker if worker else getattr(settings, 'IMAGES_WORKER', 'thread')
+    if not isinstance(worker, str):
+        return worker
+    with _workers_lock:
+        if worker not in _workers:
+            if worker == 'thread':
+                _workers[worker] = ThreadWorker()
+            elif worker == 'db':
+                _workers[worker] = DatabaseWorker()
+            else:
+                _workers[worker] = import_string(worker)()
+        return _workers[worker]
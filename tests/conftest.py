@@ -0,0 +1,20 @@
+# run from root of the repo: python -m pytest tests
+import os
+
+import django
+import pytest
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
+django.setup()
+
+
+@pytest.fixture(scope='session', autouse=True)
+def database():
+    # test database (sqlite in memory, by migrations) used by django.test.TestCase
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+    setup_test_environment()
+    name = connection.creation.create_test_db(verbosity=0)
+    yield
+    connection.creation.destroy_test_db(name, verbosity=0)
+    teardown_test_environment()
@@ -0,0 +1,12 @@
+import os
+import tempfile
+
+BASE_DIR = tempfile.mkdtemp()
+SECRET_KEY = 'tests'
+INSTALLED_APPS = ['django.contrib.contenttypes', 'rest_framework', 'onetomultipleimage']
+DATABASES = {'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}}
+DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+MEDIA_URL = '/media/'
+ROOT_URLCONF = 'onetomultipleimage.urls'     # urls of lazy sizes
+USE_TZ = True
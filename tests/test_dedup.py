@@ -0,0 +1,91 @@
+import io
+import os
+from unittest import mock
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from PIL import Image as PilImage
+
+from onetomultipleimage.dedup import DatabaseIndex, LRUIndex, get_index
+from onetomultipleimage.models import FatherImage, ImageSizes, VariantIndex
+
+
+def jpeg(width=640, height=480, color=(200, 30, 60)):
+    buffer = io.BytesIO()
+    PilImage.new('RGB', (width, height), color).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+def size_files():
+    # names of all files of ImageSizes in MEDIA_ROOT
+    root = os.path.join(settings.MEDIA_ROOT, 'ImageSizes')
+    return {os.path.relpath(os.path.join(path, name), settings.MEDIA_ROOT) for path, dirs, names in os.walk(root) for name in names}
+
+
+class LRUIndexTests(SimpleTestCase):
+    def test_add_keeps_first_entry(self):
+        index = LRUIndex(max_size=10)
+        self.assertEqual(index.add('key', ['a.JPEG']), ['a.JPEG'])
+        self.assertEqual(index.add('key', ['b.JPEG']), ['a.JPEG'])    # acquired, caller drops b.JPEG
+        self.assertEqual(index.release('key'), [])
+        self.assertEqual(index.release('key'), ['a.JPEG'])
+
+    def test_unknown_keys(self):
+        index = LRUIndex(max_size=10)
+        self.assertEqual(index.release('missing'), [])
+        self.assertFalse(index.acquire('missing'))
+
+    def test_not_shared(self):
+        self.assertIsNone(get_index('lru', shared=True))
+        self.assertIsInstance(get_index('db', shared=True), DatabaseIndex)
+
+
+@override_settings(IMAGES_DEDUP='db')
+class FatherImageDedupTests(TestCase):
+    def create(self, raw, sizes=('120', '240')):
+        image = FatherImage(image=SimpleUploadedFile('a.jpg', raw), sizes=list(sizes))
+        image.save()
+        return FatherImage.objects.get(pk=image.pk)
+
+    def names(self, image):
+        return sorted(image.imagesizes.values_list('image', flat=True))
+
+    def test_same_image_reuses_files(self):
+        raw = jpeg(color=(1, 2, 3))
+        first, before = self.create(raw), size_files()
+        second = self.create(raw)
+        self.assertEqual(self.names(first), self.names(second))
+        self.assertEqual(first.variants_key, second.variants_key)
+        self.assertEqual(size_files(), before)          # nothing generated for second one
+        self.assertEqual(VariantIndex.objects.get(key=first.variants_key).refcount, 2)
+
+    def test_files_are_deleted_with_last_image(self):
+        raw = jpeg(color=(4, 5, 6))
+        first, second = self.create(raw), self.create(raw)
+        names = self.names(first)
+        first.delete()
+        self.assertTrue(all(name in size_files() for name in names))
+        self.assertEqual(VariantIndex.objects.get(key=second.variants_key).refcount, 1)
+        second.delete()
+        self.assertFalse(any(name in size_files() for name in names))
+        self.assertFalse(VariantIndex.objects.filter(key=second.variants_key).exists())
+
+    def test_concurrent_add_drops_own_files(self):
+        # second upload misses the index (like when both uploads run at the same time) and generates its own files
+        raw = jpeg(color=(7, 8, 9))
+        first, before = self.create(raw), size_files()
+        with mock.patch.object(DatabaseIndex, 'get', return_value=None):
+            second = self.create(raw)
+        self.assertEqual(self.names(first), self.names(second))
+        self.assertEqual(size_files(), before)          # own files of second one are deleted
+        self.assertEqual(second.manifest['120']['url'], ImageSizes.objects.get(father=first, size='120').image.url)
+        first.delete()
+        self.assertTrue(all(name in size_files() for name in self.names(second)))
+
+    @override_settings(IMAGES_DEDUP='lru')
+    def test_lru_isnt_used_by_models(self):
+        raw = jpeg(color=(10, 11, 12))
+        first, second = self.create(raw), self.create(raw)
+        self.assertIsNone(first.variants_key)
+        self.assertNotEqual(self.names(first), self.names(second))
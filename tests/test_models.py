@@ -0,0 +1,94 @@
+import io
+from unittest import mock
+
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase
+from PIL import Image as PilImage
+
+from onetomultipleimage.methods import DecodedImage, ImageCreationSizes, decode_image
+from onetomultipleimage.models import FatherImage
+
+
+def jpeg(width=640, height=480, orientation=None):
+    buffer = io.BytesIO()
+    image = PilImage.new('RGB', (width, height), (200, 30, 60))
+    exif = image.getexif()
+    if orientation:
+        exif[0x0112] = orientation
+    image.save(buffer, 'JPEG', exif=exif)
+    return buffer.getvalue()
+
+
+class UpdateSizesTests(TestCase):
+    def setUp(self):
+        image = FatherImage(image=SimpleUploadedFile('a.jpg', jpeg()), sizes=['120', '240'])
+        image.save()
+        self.image = FatherImage.objects.get(pk=image.pk)
+        self.names = self.sizes()
+
+    def sizes(self):
+        # like: {'120': 'ImageSizes/2024/5/13/qwer43asd2e4-120.JPEG', ...}
+        return dict(self.image.imagesizes.values_list('size', 'image'))
+
+    def test_added_sizes_are_created(self):
+        self.image.sizes = ['120', '240', '480']
+        self.image.save()
+        names = self.sizes()
+        self.assertEqual(sorted(names), ['120', '240', '480'])
+        self.assertEqual({size: names[size] for size in self.names}, self.names)   # kept sizes aren't generated again
+        self.assertTrue(default_storage.exists(names['480']))
+        self.assertEqual(sorted(self.image.manifest), ['120', '240', '480'])
+
+    def test_removed_sizes_are_deleted_with_files(self):
+        self.image.sizes = ['120']
+        self.image.save()
+        self.assertEqual(self.sizes(), {'120': self.names['120']})
+        self.assertFalse(default_storage.exists(self.names['240']))
+        self.assertTrue(default_storage.exists(self.names['120']))
+        self.assertEqual(list(self.image.manifest), ['120'])
+
+    def test_alt_only_edit_does_no_file_work(self):
+        self.image.alt = 'sea'
+        with mock.patch.object(ImageCreationSizes, 'save', side_effect=AssertionError('files generated')):
+            self.image.save()
+        self.assertEqual(self.sizes(), self.names)
+        self.assertEqual(sorted(self.image.imagesizes.values_list('alt', flat=True)), ['sea-120', 'sea-240'])
+        self.assertEqual(self.image.alt, 'sea-default')
+
+    def test_changed_image_generates_all_sizes_again(self):
+        self.image.image = SimpleUploadedFile('b.jpg', jpeg(800, 600))
+        self.image.save()
+        names = self.sizes()
+        self.assertEqual(sorted(names), ['120', '240'])
+        self.assertTrue(all(names[size] != self.names[size] for size in names))
+        self.assertEqual(self.image.manifest['240']['height'], 180)
+
+
+class ManifestTests(TestCase):
+    def test_lazy_sizes_use_oriented_size(self):
+        # rotated photo (exif orientation 6) is 480x640 after orientation, nothing is decoded in lazy mode
+        image = FatherImage(image=SimpleUploadedFile('a.jpg', jpeg(orientation=6)), sizes=['120'])
+        image.save(lazy=True)
+        self.assertEqual((image.manifest['120']['width'], image.manifest['120']['height']), (120, 160))
+
+    def test_added_sizes_use_oriented_size(self):
+        image = FatherImage(image=SimpleUploadedFile('a.jpg', jpeg(orientation=6)), sizes=['120'])
+        image.save()
+        image = FatherImage.objects.get(pk=image.pk)
+        image.sizes = ['120', '240']
+        image.save()
+        self.assertEqual({size: (variant['width'], variant['height']) for size, variant in image.manifest.items()},
+                         {'120': (120, 160), '240': (240, 320)})
+
+
+class DecodeReuseTests(TestCase):
+    def test_decoded_upload_is_reused(self):
+        upload = SimpleUploadedFile('a.jpg', jpeg())
+        decoded = decode_image(upload)
+        image = FatherImage(image=upload, sizes=['120', 'default'])
+        with mock.patch.object(DecodedImage, '__init__', side_effect=AssertionError('decoded again')):
+            image.save()
+        self.assertIs(image.image.decoded_image, decoded)
+        self.assertIs(decoded.stream, image.image)     # reads the stored file from now on
+        self.assertEqual(sorted(image.manifest), ['120', 'default'])
@@ -0,0 +1,84 @@
+import io
+import tempfile
+
+from django.core.files.storage import FileSystemStorage, InMemoryStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase
+from PIL import Image as PilImage
+
+from onetomultipleimage.methods import ImageCreationSizes, LazyUploadedFile
+from onetomultipleimage.storage import BatchWriter
+
+
+def jpeg(width=640, height=480):
+    buffer = io.BytesIO()
+    PilImage.new('RGB', (width, height), (200, 30, 60)).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+class BatchWriterTests(SimpleTestCase):
+    def test_flush_writes_all_files(self):
+        storage = InMemoryStorage()
+        writer = BatchWriter(storage)
+        writer.add('posts/a-120.JPEG', io.BytesIO(b'120'))
+        writer.add('posts/a-240.JPEG', io.BytesIO(b'240240'))
+        saved = writer.flush()
+        self.assertEqual(saved, {'posts/a-120.JPEG': ('posts/a-120.JPEG', 3), 'posts/a-240.JPEG': ('posts/a-240.JPEG', 6)})
+        self.assertEqual(storage.open('posts/a-240.JPEG').read(), b'240240')
+        self.assertEqual(writer.flush(), {})
+
+    def test_flush_returns_names_changed_by_storage(self):
+        storage = InMemoryStorage()
+        storage.save('posts/a-120.JPEG', io.BytesIO(b'old'))
+        writer = BatchWriter(storage)
+        writer.add('posts/a-120.JPEG', io.BytesIO(b'new'))
+        writer.add('posts/a-240.JPEG', io.BytesIO(b'240'))
+        saved = writer.flush()
+        name, size = saved['posts/a-120.JPEG']
+        self.assertNotEqual(name, 'posts/a-120.JPEG')
+        self.assertEqual((storage.open(name).read(), size), (b'new', 3))
+        self.assertEqual(storage.open('posts/a-120.JPEG').read(), b'old')
+
+
+class LazyUploadedFileTests(SimpleTestCase):
+    def test_reads_and_reopens_through_storage(self):
+        storage = InMemoryStorage()
+        name = storage.save('posts/a-120.JPEG', io.BytesIO(b'content'))
+        file = LazyUploadedFile(storage, name, 'image/jpeg')
+        self.assertEqual(file.name, 'a-120.JPEG')
+        self.assertEqual(file.size, 7)       # asked from storage
+        self.assertEqual(file.read(), b'content')
+        file.close()
+        self.assertEqual(file.open().read(), b'content')
+        self.assertEqual(file.read(), b'')
+        self.assertEqual(file.open().read(), b'content')
+
+    def test_known_size_isnt_asked_from_storage(self):
+        file = LazyUploadedFile(InMemoryStorage(), 'posts/missing.JPEG', 'image/jpeg', size=10)
+        self.assertEqual(file.size, 10)
+
+
+class UploadStorageTests(SimpleTestCase):
+    def upload(self, storage):
+        image = SimpleUploadedFile('a.jpg', jpeg())
+        return ImageCreationSizes({'image': image}, ['120', 'default'], storage=storage, dedup=False).upload('posts/')
+
+    def test_in_memory_storage(self):
+        storage = InMemoryStorage(base_url='/cdn/')
+        objects = self.upload(storage)
+        self.assertEqual([obj.size for obj in objects], [120, 'default'])
+        for obj in objects:
+            self.assertTrue(obj.name.startswith('posts/'))
+            self.assertEqual(obj.url, '/cdn/' + obj.name)
+            self.assertTrue(storage.exists(obj.name))
+        self.assertEqual(PilImage.open(objects[0].image).size, (120, 90))
+        self.assertEqual(objects[1].image.size, storage.size(objects[1].name))
+
+    def test_file_system_storage(self):
+        with tempfile.TemporaryDirectory() as location:
+            storage = FileSystemStorage(location=location, base_url='/files/')
+            objects = self.upload(storage)
+            for obj in objects:
+                self.assertEqual(obj.url, '/files/' + obj.name)
+                self.assertTrue(storage.exists(obj.name))   # date directories are created by the storage
+            objects[0].image.close()